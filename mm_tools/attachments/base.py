@@ -1,6 +1,6 @@
 from typing import List, Union
 
-from mm_tools.helpers import compress_json
+from mm_tools.helpers import pack_payload, payload_render_scope
 
 
 class ActionElement:
@@ -34,7 +34,7 @@ class Button(ActionElement):
         }
         
         if self.payload:
-            context["payload"] = compress_json(self.payload)
+            context["payload"] = pack_payload(self.payload)
         
         data = {
             "name": self.text,
@@ -119,7 +119,7 @@ class Select(ActionElement):
         }
         
         if self.payload:
-            context["payload"] = compress_json(self.payload)
+            context["payload"] = pack_payload(self.payload)
         
         return {
             "name": self.text,
@@ -160,7 +160,7 @@ class SelectUsers(ActionElement):
         }
         
         if self.payload:
-            context["payload"] = compress_json(self.payload)
+            context["payload"] = pack_payload(self.payload)
         
         return {
             "name": self.text,
@@ -231,10 +231,11 @@ class Attachment:
             ]
 
         if self.actions:
-            attachments['attachments'][0]['actions'] = [
-                x.to_dict()
-                for x in self.actions
-            ]
+            with payload_render_scope():
+                attachments['attachments'][0]['actions'] = [
+                    x.to_dict()
+                    for x in self.actions
+                ]
 
         if self.text:
             attachments['attachments'][0]['text'] = self.text
@@ -265,10 +266,11 @@ class Attachment:
     def glue_attachments(
             attachments: List['Attachment']
     ):
-        return {
-            'attachments': [
-                x.to_dict()['attachments'][0]
-                for x in attachments
-            ]
-        }
+        with payload_render_scope():
+            return {
+                'attachments': [
+                    x.to_dict()['attachments'][0]
+                    for x in attachments
+                ]
+            }
 
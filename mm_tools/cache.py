@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUTTLCache:
+    """
+    Thread-safe in-memory cache bounded by size (LRU eviction) and entry age (TTL).
+
+    Args:
+        max_size (int): Maximum number of entries. The least recently used entry is evicted first.
+        ttl (float, optional): Seconds an entry stays valid after it was written. None disables expiry.
+
+    Notes:
+        - Expired entries are dropped lazily, when they are read or pushed out by new entries.
+        - Values are stored as is; callers that hand out mutable values should copy them.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 300):
+        if max_size < 1:
+            raise ValueError('max_size must be >= 1')
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches ``predicate``; return how many were dropped."""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -1,7 +1,7 @@
 import json
 from uuid import uuid4
 
-from mm_tools.helpers import compress_json
+from mm_tools.helpers import pack_payload
 
 
 class DialogElement:
@@ -354,7 +354,7 @@ class Dialog:
         state_data = {'session_id': self.session_id}
         
         if self.payload:
-            state_data['payload'] = compress_json(self.payload)
+            state_data['payload'] = pack_payload(self.payload)
         
         return {
             'trigger_id': self.trigger_id,
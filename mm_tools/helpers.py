@@ -1,27 +1,168 @@
 import lzma
+import zlib
 import base64
 import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
 
 import msgpack
 
+from mm_tools.payload_store import get_payload_store
+
+# Compressed payloads look like "<codec id>:<base85 data>". ':' is not part of the
+# base85 alphabet, so strings without it are legacy headerless LZMA payloads.
+_HEADER_SEPARATOR = ':'
+# Header of server-side payload handles, see ``mm_tools.payload_store``.
+_HANDLE_CODEC = 'h'
+_PAYLOAD_CODECS: dict[str, tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {}
+
+_default_codec = 'z'
+_compress_threshold = 128
+
+# packed payload -> encoded payload, active inside ``payload_render_scope``
+_render_cache: ContextVar[Optional[dict[bytes, str]]] = ContextVar('payload_render_cache', default=None)
+
+
+class PayloadNotFoundError(KeyError):
+    """A payload handle is not in the payload store (expired, purged or never stored here)."""
+
+
+def register_payload_codec(
+        codec_id: str,
+        compress: Callable[[bytes], bytes],
+        decompress: Callable[[bytes], bytes]
+) -> None:
+    """
+    Register a compression codec for state payloads.
+
+    Args:
+        codec_id (str): Short identifier written into the payload header. Must not contain ':'.
+        compress (Callable[[bytes], bytes]): Compresses msgpack-packed payload bytes.
+        decompress (Callable[[bytes], bytes]): Reverses ``compress``.
+    """
+    if not codec_id or _HEADER_SEPARATOR in codec_id or codec_id == _HANDLE_CODEC:
+        raise ValueError(f'Invalid codec id: {codec_id!r}')
+    _PAYLOAD_CODECS[codec_id] = (compress, decompress)
+
+
+def configure_payload_compression(codec: str = None, threshold: int = None) -> None:
+    """
+    Set the codec used by ``compress_json`` by default.
+
+    Args:
+        codec (str, optional): Registered codec id, e.g. 'z' (zlib), 'x' (lzma) or 'n' (no compression).
+        threshold (int, optional): Packed payloads smaller than this many bytes are stored uncompressed.
+    """
+    global _default_codec, _compress_threshold
+
+    if codec is not None:
+        if codec not in _PAYLOAD_CODECS:
+            raise ValueError(f'Unknown payload codec: {codec!r}')
+        _default_codec = codec
+    if threshold is not None:
+        _compress_threshold = threshold
+
+
+register_payload_codec('n', bytes, bytes)
+register_payload_codec('z', lambda data: zlib.compress(data, 6), zlib.decompress)
+register_payload_codec('x', lambda data: lzma.compress(data, preset=1), lzma.decompress)
+
+
+def compress_json(data: dict, codec: str = None) -> str:
+    return _compress_packed(msgpack.packb(data, use_bin_type=True), codec)
+
+
+def _compress_packed(packed: bytes, codec: str = None) -> str:
+    if codec is None:
+        codec = _default_codec if len(packed) >= _compress_threshold else 'n'
+
+    compressed = _PAYLOAD_CODECS[codec][0](packed)
+    if len(compressed) >= len(packed):
+        codec, compressed = 'n', packed
+
+    return codec + _HEADER_SEPARATOR + base64.b85encode(compressed).decode('ascii')
+
+
+@contextmanager
+def payload_render_scope():
+    """
+    Memoize ``pack_payload`` for the duration of one render pass.
+
+    Inside the scope identical payloads (compared by their packed bytes) are compressed
+    or written to the payload store only once. Nested scopes reuse the outer one.
+
+    Example:
+        with payload_render_scope():
+            actions = [button.to_dict() for button in buttons]
+    """
+    if _render_cache.get() is not None:
+        yield
+        return
+
+    token = _render_cache.set({})
+    try:
+        yield
+    finally:
+        _render_cache.reset(token)
+
+
+def pack_payload(data: dict) -> str:
+    """Encode an action payload: a store handle if a payload store is set, else ``compress_json``."""
+    cache = _render_cache.get()
+    if cache is None:
+        return _pack_payload(data, msgpack.packb(data, use_bin_type=True))
 
-def compress_json(data: dict) -> str:
     packed = msgpack.packb(data, use_bin_type=True)
-    compressed = lzma.compress(packed, preset=9)
-    return base64.b85encode(compressed).decode('ascii')
+    encoded = cache.get(packed)
+    if encoded is None:
+        encoded = cache[packed] = _pack_payload(data, packed)
+    return encoded
+
+
+def _pack_payload(data: dict, packed: bytes) -> str:
+    store = get_payload_store()
+    if store is None:
+        return _compress_packed(packed)
+    return _HANDLE_CODEC + _HEADER_SEPARATOR + store.put(data)
 
 
 def decompress_json(compressed_str: str) -> dict:
-    compressed = base64.b85decode(compressed_str.encode('ascii'))
-    packed = lzma.decompress(compressed)
+    codec, separator, body = compressed_str.partition(_HEADER_SEPARATOR)
+    if codec == _HANDLE_CODEC and separator:
+        store = get_payload_store()
+        data = store.get(body) if store is not None else None
+        if data is None:
+            raise PayloadNotFoundError(f'Payload {body!r} is not in the payload store')
+        return data
+    if separator:
+        packed = _PAYLOAD_CODECS[codec][1](base64.b85decode(body.encode('ascii')))
+    else:
+        packed = lzma.decompress(base64.b85decode(compressed_str.encode('ascii')))
     return msgpack.unpackb(packed, raw=False)
 
 
+def read_attachment_context(context: dict) -> dict:
+    """
+    Return a copy of an attachment action context with its payload decoded.
+
+    A payload that can no longer be resolved (e.g. an expired store handle on an old
+    message) is returned as an empty dict.
+    """
+    data = dict(context or {})
+    if data.get('payload'):
+        try:
+            data['payload'] = decompress_json(data['payload'])
+        except PayloadNotFoundError:
+            data['payload'] = {}
+    return data
+
+
 def read_dialog_state(state: str) -> dict:
     try:
         data = json.loads(state)
         if data.get('payload'):
             data['payload'] = decompress_json(data['payload'])
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, PayloadNotFoundError):
         return {}
     return data
@@ -0,0 +1,235 @@
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+import msgpack
+import peewee
+
+from mm_tools.cache import LRUTTLCache
+from mm_tools.plugins.cache_db.models.base_model import sync_database
+from mm_tools.plugins.cache_db.models.plugins_models import PluginsPayload
+from mm_tools.sessions.sessions import SQLiteConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+def _pack(data: dict) -> bytes:
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _unpack(packed: bytes) -> dict:
+    return msgpack.unpackb(packed, raw=False)
+
+
+def payload_key(packed: bytes) -> str:
+    """Content address of a packed payload: identical payloads share one key."""
+    return hashlib.blake2b(packed, digest_size=12).hexdigest()
+
+
+class BasePayloadStore:
+    """
+    Server-side storage for action payloads.
+
+    ``put`` saves a payload and returns a short key that is embedded into the action
+    context instead of the payload itself; ``get`` resolves the key back. Keys are
+    content addresses, so storing the same payload twice only refreshes it.
+    """
+
+    def put(self, data: dict) -> str:
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        """Delete payloads older than the store's TTL; return how many were deleted."""
+        return 0
+
+    def start_purge(self, interval: float = 3600) -> None:
+        """Run ``purge_expired`` every ``interval`` seconds in a background thread."""
+        if getattr(self, '_purge_thread', None) is not None:
+            return
+        self._purge_stop = threading.Event()
+        self._purge_thread = threading.Thread(
+            target=self._purge_loop,
+            args=(interval,),
+            name='payload-purge',
+            daemon=True
+        )
+        self._purge_thread.start()
+
+    def stop_purge(self) -> None:
+        if getattr(self, '_purge_thread', None) is None:
+            return
+        self._purge_stop.set()
+        self._purge_thread.join()
+        self._purge_thread = None
+
+    def _purge_loop(self, interval: float) -> None:
+        while not self._purge_stop.wait(interval):
+            try:
+                self.purge_expired()
+            except Exception:
+                logger.exception('Failed to purge expired payloads')
+
+
+class MemoryPayloadStore(BasePayloadStore):
+    """
+    Process-local payload store. Payloads are lost on restart, so actions of messages
+    posted before a restart can no longer be resolved.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = 7 * 24 * 3600):
+        self._cache = LRUTTLCache(max_size=max_size, ttl=ttl)
+
+    def put(self, data: dict) -> str:
+        packed = _pack(data)
+        key = payload_key(packed)
+        self._cache.set(key, packed)
+        return key
+
+    def get(self, key: str) -> Optional[dict]:
+        packed = self._cache.get(key)
+        return _unpack(packed) if packed is not None else None
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+class SQLitePayloadStore(BasePayloadStore):
+    """
+    Payload store in a local SQLite database, shared by all processes on the host.
+
+    Expired payloads are purged in the background every ``purge_interval`` seconds;
+    pass None to disable it and call ``purge_expired`` yourself.
+    """
+
+    _TABLE = 'payloads'
+
+    def __init__(
+            self,
+            db_path: str = '.payloads.db',
+            ttl: Optional[float] = 7 * 24 * 3600,
+            pool_size: int = 4,
+            purge_interval: Optional[float] = 3600
+    ):
+        self.ttl = ttl
+        self._pool = SQLiteConnectionPool(db_path, pool_size=pool_size)
+        with self._pool.connection() as client:
+            client.execute(
+                f'''CREATE TABLE IF NOT EXISTS {self._TABLE} (
+                    key TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )'''
+            )
+            client.execute(
+                f'CREATE INDEX IF NOT EXISTS {self._TABLE}_created_at_idx ON {self._TABLE} (created_at)'
+            )
+            client.commit()
+
+        if ttl and purge_interval:
+            self.start_purge(purge_interval)
+
+    def put(self, data: dict) -> str:
+        packed = _pack(data)
+        key = payload_key(packed)
+        with self._pool.connection() as client:
+            client.execute(
+                f'''INSERT INTO {self._TABLE} (key, data, created_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(key) DO UPDATE SET created_at=CURRENT_TIMESTAMP''',
+                (key, packed)
+            )
+            client.commit()
+        return key
+
+    def get(self, key: str) -> Optional[dict]:
+        sql = f'SELECT data FROM {self._TABLE} WHERE key=?'
+        params = [key]
+        if self.ttl:
+            sql += " AND created_at >= datetime('now', ?)"
+            params.append(f'-{int(self.ttl)} seconds')
+
+        with self._pool.connection() as client:
+            row = client.execute(sql, params).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def purge_expired(self) -> int:
+        if not self.ttl:
+            return 0
+        with self._pool.connection() as client:
+            cur = client.execute(
+                f"DELETE FROM {self._TABLE} WHERE created_at < datetime('now', ?)",
+                (f'-{int(self.ttl)} seconds',)
+            )
+            client.commit()
+        return cur.rowcount
+
+
+class PostgresPayloadStore(BasePayloadStore):
+    """
+    Payload store in the shared PostgreSQL database (``plugins_payloads`` table), so every
+    bot replica can resolve payloads written by another one.
+
+    Notes:
+        - ``to_dict`` is synchronous, so queries run synchronously on ``sync_database()``,
+          which keeps one connection per thread. Every render and every inbound action
+          still costs a query round trip on the event loop; use ``SQLitePayloadStore``
+          when payloads do not have to be shared between replicas.
+        - Expired payloads are purged in the background every ``purge_interval`` seconds
+          (None disables it).
+    """
+
+    def __init__(self, ttl: Optional[float] = 7 * 24 * 3600, purge_interval: Optional[float] = 3600):
+        self.ttl = ttl
+        if ttl and purge_interval:
+            self.start_purge(purge_interval)
+
+    def put(self, data: dict) -> str:
+        packed = _pack(data)
+        key = payload_key(packed)
+        PluginsPayload.insert(
+            key=key,
+            data=packed,
+            created_at=peewee.fn.now()
+        ).on_conflict(
+            conflict_target=[PluginsPayload.key],
+            update={PluginsPayload.created_at: peewee.fn.now()}
+        ).execute(sync_database())
+        return key
+
+    def get(self, key: str) -> Optional[dict]:
+        query = PluginsPayload.select(PluginsPayload.data).where(PluginsPayload.key == key)
+        if self.ttl:
+            query = query.where(
+                PluginsPayload.created_at >= peewee.SQL('now() - make_interval(secs => %s)', (self.ttl,))
+            )
+
+        row = query.first(sync_database())
+        return _unpack(bytes(row.data)) if row else None
+
+    def purge_expired(self) -> int:
+        if not self.ttl:
+            return 0
+        return PluginsPayload.delete().where(
+            PluginsPayload.created_at < peewee.SQL('now() - make_interval(secs => %s)', (self.ttl,))
+        ).execute(sync_database())
+
+
+_payload_store: Optional[BasePayloadStore] = None
+
+
+def set_payload_store(store: Optional[BasePayloadStore]) -> None:
+    """
+    Enable server-side payloads: while a store is set, ``Button``, ``Select``,
+    ``SelectUsers`` and ``Dialog`` embed a short handle instead of the compressed payload.
+    Pass None to go back to inline payloads.
+    """
+    global _payload_store
+    _payload_store = store
+
+
+def get_payload_store() -> Optional[BasePayloadStore]:
+    return _payload_store
@@ -1,8 +1,12 @@
+import asyncio
 import importlib
 import io
 import json
+import logging
+import random
+import tempfile
 from logging import Logger
-from typing import Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
 
 from mmpy_bot import Plugin, ActionEvent, Message
 from mmpy_bot.function import Function
@@ -10,23 +14,84 @@ from mmpy_bot.wrappers import EventWrapper
 from peewee_async import Manager
 
 from .cache_db.models.base_model import pooled_database
+from .direct_channels import DirectChannelCache
+from .event_log import RecentEvents, enable_queue_logging, event_fingerprint
+from .executor import AsyncPluginProxy, BlockingCallExecutor
+from .file_cache import FileContentCache
 from .state_machine import StateMachine
+from .user_cache import UserCache
+
+# Сколько id отправляется в одном запросе POST users/ids
+USERS_BY_IDS_CHUNK = 200
+
+
+def _spool(name: str, content: bytes, threshold: int) -> tuple[str, tempfile.SpooledTemporaryFile]:
+    """Файлы больше ``threshold`` байт уходят на диск, чтобы не держать все вложения в памяти."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=threshold)
+    spooled.write(content)
+    spooled.seek(0)
+    return name, spooled
+
+
+def _close_files(files: list[tuple[str, Any]]) -> None:
+    for _, file in files:
+        if hasattr(file, 'close'):
+            file.close()
+
+
+def _format_full_name(user_info: dict) -> str:
+    if user_info['first_name'] and user_info['last_name']:
+        return f'{user_info["first_name"]} {user_info["last_name"]}'
+
+    return user_info['username'].title()
 
 
 class BasePlugin(Plugin):
     state = StateMachine()
-    last_log = None
+    # Отпечатки недавно залогированных событий: одно событие, пришедшее в несколько функций, логируется один раз
+    logged_events = RecentEvents()
     database_manager = Manager(pooled_database)
+    # Общий для всех плагинов кэш пользователей; None отключает кэширование.
+    user_cache: Optional[UserCache] = UserCache()
+    # user_id -> id директа с ботом; DirectChannelCache(persistent=True) хранит его в БД.
+    direct_channels: Optional[DirectChannelCache] = DirectChannelCache()
+    # Сколько загрузок файлов идёт параллельно (AsyncBasePlugin) и сколько файлов
+    # отправляется одним запросом POST files; 1 — по запросу на файл.
+    upload_concurrency = 4
+    upload_batch_size = 5
+    # Пересылаемые файлы больше порога (в байтах) хранятся во временном файле на диске
+    upload_spool_threshold = 1024 * 1024
+    # Дисковый кэш содержимого пересылаемых файлов: повторная пересылка не скачивает файл заново
+    file_cache: Optional[FileContentCache] = None
+    # Пул потоков для блокирующих вызовов драйвера из async-обработчиков, см. ``aio``
+    blocking_executor = BlockingCallExecutor()
+    # При старте бота предзагрузить из backend состояния пользователей, активных
+    # за последние N секунд (нужен StateMachine с backend); None — не прогревать.
+    state_warm_up_seconds: Optional[float] = None
+    state_warm_up_limit = 10000
 
     def __init__(
             self,
             logger: Logger = None,
             log_raw_json: bool = False,
             sentry_profile: bool = False,
-            sentry_profile_prefix: str = None
+            sentry_profile_prefix: str = None,
+            log_raw_json_indent: Optional[int] = 2,
+            log_raw_json_sample_rate: float = 1.0,
+            log_queue: bool = False
     ):
+        """
+        Args:
+            log_raw_json_indent: отступ raw_json; None — компактный JSON в одну строку.
+            log_raw_json_sample_rate: доля событий, к которым прикладывается raw_json.
+            log_queue: писать логи через QueueHandler, чтобы форматирование и I/O шли вне event loop.
+        """
         self.logger = logger
         self.log_raw_json = log_raw_json
+        self.log_raw_json_indent = log_raw_json_indent
+        self.log_raw_json_sample_rate = log_raw_json_sample_rate
+        if logger and log_queue:
+            enable_queue_logging(logger)
 
         self.sentry_profile_prefix = sentry_profile_prefix
         self.sentry_module = None
@@ -39,8 +104,34 @@ class BasePlugin(Plugin):
 
         super().__init__()
 
+    def on_start(self):
+        result = super().on_start()
+        if self.state_warm_up_seconds:
+            self.state.warm_up(self.state_warm_up_seconds, self.state_warm_up_limit)
+        return result
+
+    @property
+    def aio(self) -> AsyncPluginProxy:
+        """
+        Неблокирующие версии синхронных методов: ``await self.aio.direct_post(user_id, 'text')``
+        выполняет ``direct_post`` в ``blocking_executor`` и не останавливает event loop.
+        """
+        return AsyncPluginProxy(self)
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Выполнение произвольного блокирующего вызова в ``blocking_executor``."""
+        return await self.blocking_executor.run(func, *args, **kwargs)
+
+    def _raw_json(self, body: dict) -> str:
+        if self.log_raw_json_sample_rate < 1 and random.random() >= self.log_raw_json_sample_rate:
+            return ""
+
+        if self.log_raw_json_indent is None:
+            return json.dumps(body, ensure_ascii=False, separators=(',', ':'))
+        return json.dumps(body, indent=self.log_raw_json_indent, ensure_ascii=False)
+
     async def logging_event(self, event: EventWrapper, matcher: str = None) -> None:
-        if self.logger:
+        if self.logger and self.logger.isEnabledFor(logging.INFO):
             if self.log_raw_json:
                 message = ""
                 if event.body.get("event") == "posted":
@@ -58,7 +149,7 @@ class BasePlugin(Plugin):
                 self.logger.info(
                     message,
                     extra={
-                        "raw_json": json.dumps(event.body, indent=2, ensure_ascii=False)
+                        "raw_json": self._raw_json(event.body)
                     }
                 )
             else:
@@ -72,9 +163,12 @@ class BasePlugin(Plugin):
     ):
         """ Логирование """
 
-        if event.body != BasePlugin.last_log:
+        if (
+                self.logger
+                and self.logger.isEnabledFor(logging.INFO)
+                and self.logged_events.add(event_fingerprint(event.body))
+        ):
             await self.logging_event(event, function.matcher.pattern)
-            BasePlugin.last_log = event.body
 
         if self.sentry_module:
             profile_name = function.name
@@ -125,21 +219,30 @@ class BasePlugin(Plugin):
     ) -> bytes:
         return self.driver.files.get_file(file_id).content
 
+    def _open_forwarded_file(self, file: dict) -> tuple[str, Any]:
+        if self.file_cache is None:
+            return _spool(file['name'], self.get_file(file['id']), self.upload_spool_threshold)
+
+        cached = self.file_cache.open(file['id'])
+        if cached is None:
+            cached = open(self.file_cache.put(file['id'], self.get_file(file['id'])), 'rb')
+        return file['name'], cached
+
+    def _upload_batch(self, channel_id: str, files: list[tuple[str, Any]]) -> list[str]:
+        upload_resp = self.driver.files.upload_file(
+            data={'channel_id': channel_id},
+            files=[('files', file) for file in files]
+        )
+        return [file_info['id'] for file_info in upload_resp['file_infos']]
+
     def upload_file(
             self,
             channel_id: str,
             files: list[tuple[str, io.BytesIO]],
     ):
         files_ids = []
-        for file in files:
-            files_ids.append(
-                (self.driver.files.upload_file(
-                    data={'channel_id': channel_id},
-                    files={
-                        'files': file
-                    }
-                ))['file_infos'][0]['id']
-            )
+        for start in range(0, len(files), self.upload_batch_size):
+            files_ids.extend(self._upload_batch(channel_id, files[start:start + self.upload_batch_size]))
 
         self.driver.posts.create_post(
             options={
@@ -149,20 +252,71 @@ class BasePlugin(Plugin):
         )
 
     def get_user_info(self, user_id: str) -> dict:
-        return self.driver.users.get_user(user_id=user_id)
+        if self.user_cache is None:
+            return self.driver.users.get_user(user_id=user_id)
+
+        return self.user_cache.fetch(
+            user_id,
+            lambda uid: self.driver.users.get_user(user_id=uid)
+        )
 
     def get_user_name(self, user_id: str):
         return (self.get_user_info(user_id))['username']
 
     def get_user_full_name(self, user_id: str) -> str:
-        user_info = self.get_user_info(user_id)
-        if user_info['first_name'] and user_info['last_name']:
-            return f'{user_info["first_name"]} {user_info["last_name"]}'
+        return _format_full_name(self.get_user_info(user_id))
+
+    def _split_cached_users(self, user_ids: Iterable[str]) -> tuple[list[str], dict[str, dict], list[str]]:
+        user_ids = list(dict.fromkeys(user_ids))
+        if self.user_cache is None:
+            return user_ids, {}, user_ids
 
-        return user_info['username'].title()
+        found, missing = self.user_cache.get_many(user_ids)
+        return user_ids, found, missing
+
+    def _collect_users(
+            self,
+            user_ids: list[str],
+            found: dict[str, dict],
+            fetched: Iterable[dict]
+    ) -> dict[str, dict]:
+        fetched = list(fetched)
+        if self.user_cache is not None:
+            self.user_cache.set_many(fetched)
+
+        found.update((user_info['id'], user_info) for user_info in fetched)
+        return {user_id: found[user_id] for user_id in user_ids if user_id in found}
+
+    def get_users_info(self, user_ids: Iterable[str]) -> dict[str, dict]:
+        """
+        Получение пользователей пачкой через POST users/ids.
+
+        Возвращает {user_id: user}; несуществующие id в результат не попадают.
+        """
+        user_ids, found, missing = self._split_cached_users(user_ids)
+
+        fetched = []
+        for start in range(0, len(missing), USERS_BY_IDS_CHUNK):
+            fetched.extend(self.driver.users.get_users_by_ids(
+                options=missing[start:start + USERS_BY_IDS_CHUNK]
+            ))
+
+        return self._collect_users(user_ids, found, fetched)
+
+    def get_users_full_names(self, user_ids: Iterable[str]) -> dict[str, str]:
+        return {
+            user_id: _format_full_name(user_info)
+            for user_id, user_info in self.get_users_info(user_ids).items()
+        }
 
     def get_direct_from_user(self, user_id: str) -> str:
-        return (self.driver.channels.create_direct_channel([self.driver.user_id, user_id]))["id"]
+        def create_direct_channel() -> str:
+            return (self.driver.channels.create_direct_channel([self.driver.user_id, user_id]))["id"]
+
+        if self.direct_channels is None:
+            return create_direct_channel()
+
+        return self.direct_channels.get(self.driver.user_id, user_id, create_direct_channel)
 
     def direct_post(
             self,
@@ -204,15 +358,18 @@ class BasePlugin(Plugin):
         return action_event
 
     def send_files_from_message(self, message: Message, channel_id: str) -> list[str]:
-        return [
-            (self.driver.files.upload_file(
-                data={'channel_id': channel_id},
-                files={
-                    'files': (file['name'], (self.driver.files.get_file(file['id'])).content)
-                }
-            ))['file_infos'][0]['id']
-            for file in message.body['data']['post']['metadata']['files']
-        ]
+        message_files = message.body['data']['post']['metadata']['files']
+
+        files_ids = []
+        for start in range(0, len(message_files), self.upload_batch_size):
+            files = []
+            try:
+                for file in message_files[start:start + self.upload_batch_size]:
+                    files.append(self._open_forwarded_file(file))
+                files_ids.extend(self._upload_batch(channel_id, files))
+            finally:
+                _close_files(files)
+        return files_ids
 
 
 class AsyncBasePlugin(BasePlugin):
@@ -255,20 +412,51 @@ class AsyncBasePlugin(BasePlugin):
         resp = await self.driver.files.get_file(file_id)
         return resp.content
 
+    async def _upload_batch(self, channel_id: str, files: list[tuple[str, Any]]) -> list[str]:
+        upload_resp = await self.driver.files.upload_file(
+            data={'channel_id': channel_id},
+            files=[('files', file) for file in files]
+        )
+        return [file_info['id'] for file_info in upload_resp['file_infos']]
+
+    async def _upload_concurrently(
+            self,
+            channel_id: str,
+            items: list,
+            prepare: Callable[[Any], Awaitable[tuple[str, Any]]] = None
+    ) -> list[str]:
+        """
+        Загрузка пачками по ``upload_batch_size`` файлов, не более ``upload_concurrency`` пачек
+        одновременно. ``prepare`` готовит файл (например, скачивает) уже внутри слота,
+        поэтому в памяти одновременно находятся только файлы загружаемых пачек.
+        """
+        semaphore = asyncio.Semaphore(self.upload_concurrency)
+
+        async def upload(batch: list) -> list[str]:
+            async with semaphore:
+                if prepare is None:
+                    return await self._upload_batch(channel_id, batch)
+
+                files = []
+                try:
+                    for item in batch:
+                        files.append(await prepare(item))
+                    return await self._upload_batch(channel_id, files)
+                finally:
+                    _close_files(files)
+
+        batches = await asyncio.gather(*(
+            upload(items[start:start + self.upload_batch_size])
+            for start in range(0, len(items), self.upload_batch_size)
+        ))
+        return [file_id for batch in batches for file_id in batch]
+
     async def upload_file(
             self,
             channel_id: str,
             files: list[tuple[str, io.BytesIO]],
     ) -> None:
-        files_ids = []
-        for file in files:
-            upload_resp = await self.driver.files.upload_file(
-                data={'channel_id': channel_id},
-                files={
-                    'files': file
-                }
-            )
-            files_ids.append(upload_resp['file_infos'][0]['id'])
+        files_ids = await self._upload_concurrently(channel_id, files)
 
         await self.driver.posts.create_post(
             options={
@@ -278,21 +466,44 @@ class AsyncBasePlugin(BasePlugin):
         )
 
     async def get_user_info(self, user_id: str) -> dict:
-        return await self.driver.users.get_user(user_id=user_id)
+        if self.user_cache is None:
+            return await self.driver.users.get_user(user_id=user_id)
+
+        return await self.user_cache.afetch(
+            user_id,
+            lambda uid: self.driver.users.get_user(user_id=uid)
+        )
 
     async def get_user_name(self, user_id: str):
         user_info = await self.get_user_info(user_id)
         return user_info['username']
 
     async def get_user_full_name(self, user_id: str) -> str:
-        user_info = await self.get_user_info(user_id)
-        if user_info['first_name'] and user_info['last_name']:
-            return f"{user_info['first_name']} {user_info['last_name']}"
-        return user_info['username'].title()
+        return _format_full_name(await self.get_user_info(user_id))
+
+    async def get_users_info(self, user_ids: Iterable[str]) -> dict[str, dict]:
+        user_ids, found, missing = self._split_cached_users(user_ids)
+
+        chunks = await asyncio.gather(*(
+            self.driver.users.get_users_by_ids(options=missing[start:start + USERS_BY_IDS_CHUNK])
+            for start in range(0, len(missing), USERS_BY_IDS_CHUNK)
+        ))
+
+        return self._collect_users(user_ids, found, (user_info for chunk in chunks for user_info in chunk))
+
+    async def get_users_full_names(self, user_ids: Iterable[str]) -> dict[str, str]:
+        users = await self.get_users_info(user_ids)
+        return {user_id: _format_full_name(user_info) for user_id, user_info in users.items()}
 
     async def get_direct_from_user(self, user_id: str) -> str:
-        channel = await self.driver.channels.create_direct_channel([self.driver.user_id, user_id])
-        return channel["id"]
+        async def create_direct_channel() -> str:
+            channel = await self.driver.channels.create_direct_channel([self.driver.user_id, user_id])
+            return channel["id"]
+
+        if self.direct_channels is None:
+            return await create_direct_channel()
+
+        return await self.direct_channels.aget(self.driver.user_id, user_id, create_direct_channel)
 
     async def direct_post(
             self,
@@ -334,14 +545,22 @@ class AsyncBasePlugin(BasePlugin):
         return action_event
 
     async def send_files_from_message(self, message: Message, channel_id: str) -> list[str]:
-        files_ids = []
-        for file in message.body['data']['post']['metadata']['files']:
-            file_content = await self.driver.files.get_file(file['id'])
-            upload_resp = await self.driver.files.upload_file(
-                data={'channel_id': channel_id},
-                files={
-                    'files': (file['name'], file_content.content)
-                }
-            )
-            files_ids.append(upload_resp['file_infos'][0]['id'])
-        return files_ids
+        async def download(file: dict) -> tuple[str, Any]:
+            if self.file_cache is not None:
+                cached = await asyncio.to_thread(self.file_cache.open, file['id'])
+                if cached is not None:
+                    return file['name'], cached
+
+            content = await self.get_file(file['id'])
+            if self.file_cache is None:
+                # вложения больше порога пишутся во временный файл, это блокирующая запись
+                return await asyncio.to_thread(_spool, file['name'], content, self.upload_spool_threshold)
+
+            path = await asyncio.to_thread(self.file_cache.put, file['id'], content)
+            return file['name'], open(path, 'rb')
+
+        return await self._upload_concurrently(
+            channel_id,
+            message.body['data']['post']['metadata']['files'],
+            download
+        )
@@ -0,0 +1,300 @@
+import asyncio
+import inspect
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+from mm_tools.sessions.sessions import SQLiteConnectionPool
+from mm_tools.sql_utils import MAX_IN_PARAMS, chunks, placeholders
+
+# HTTP statuses worth retrying: rate limit and server-side failures.
+_TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class BroadcastResult:
+    user_id: str
+    post_id: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.post_id is not None
+
+
+def _response_of(exc: BaseException):
+    return getattr(exc, 'response', None)
+
+
+def _status_of(exc: BaseException) -> Optional[int]:
+    response = _response_of(exc)
+    status = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+    return status if isinstance(status, int) else None
+
+
+def _rate_limit_delay(exc: BaseException) -> Optional[float]:
+    """Seconds to wait according to the 429 response headers, None if it is not a rate limit error."""
+    if _status_of(exc) != 429:
+        return None
+
+    headers = getattr(_response_of(exc), 'headers', None) or {}
+    for header in ('X-Ratelimit-Reset', 'Retry-After'):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            delay = float(value)
+        except ValueError:
+            continue
+        # Some proxies send the reset moment as a unix timestamp instead of seconds.
+        if delay > 1e9:
+            delay -= time.time()
+        return max(delay, 0.0)
+    return 0.0
+
+
+def _is_transient(exc: BaseException) -> bool:
+    status = _status_of(exc)
+    if status is not None:
+        return status in _TRANSIENT_STATUSES
+    # requests raises OSError subclasses, httpx raises TransportError subclasses.
+    return isinstance(exc, (OSError, asyncio.TimeoutError)) or any(
+        cls.__name__ == 'TransportError' for cls in type(exc).__mro__
+    )
+
+
+class BroadcastStore:
+    """
+    Progress of broadcasts in a local SQLite database, used to resume a broadcast after a restart.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+    """
+
+    _TABLE = 'broadcast_recipients'
+
+    def __init__(self, db_path: str = '.broadcasts.db'):
+        self._pool = SQLiteConnectionPool(db_path, pool_size=2)
+        with self._pool.connection() as client:
+            client.execute(
+                f'''CREATE TABLE IF NOT EXISTS {self._TABLE} (
+                    broadcast_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    post_id TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (broadcast_id, user_id)
+                )'''
+            )
+            client.commit()
+
+    def load(self, broadcast_id: str, user_ids: list[str]) -> dict[str, BroadcastResult]:
+        """Return stored results of ``user_ids`` in ``broadcast_id``."""
+        results = {}
+        with self._pool.connection() as client:
+            for chunk in chunks(user_ids, MAX_IN_PARAMS):
+                rows = client.execute(
+                    f'''SELECT user_id, post_id, error, attempts FROM {self._TABLE}
+                        WHERE broadcast_id=? AND user_id IN ({placeholders(len(chunk))})''',
+                    [broadcast_id, *chunk]
+                )
+                for user_id, post_id, error, attempts in rows:
+                    results[user_id] = BroadcastResult(user_id, post_id, error, attempts)
+        return results
+
+    def save(self, broadcast_id: str, results: Iterable[BroadcastResult]) -> None:
+        with self._pool.connection() as client:
+            client.executemany(
+                f'''INSERT INTO {self._TABLE} (broadcast_id, user_id, post_id, error, attempts, updated_at)
+                    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(broadcast_id, user_id) DO UPDATE SET
+                        post_id=excluded.post_id,
+                        error=excluded.error,
+                        attempts=excluded.attempts,
+                        updated_at=excluded.updated_at''',
+                [
+                    (broadcast_id, result.user_id, result.post_id, result.error, result.attempts)
+                    for result in results
+                ]
+            )
+            client.commit()
+
+    def forget(self, broadcast_id: str) -> None:
+        with self._pool.connection() as client:
+            client.execute(f'DELETE FROM {self._TABLE} WHERE broadcast_id=?', (broadcast_id,))
+            client.commit()
+
+
+class Broadcaster:
+    """
+    Sends the same direct message to many users with bounded, adaptive concurrency.
+
+    Args:
+        plugin: ``AsyncBasePlugin`` whose ``direct_post`` sends the messages.
+        concurrency (int): Maximum number of messages in flight.
+        max_retries (int): Retries of a recipient after a transient error (429, 5xx, network).
+        backoff (float): Base delay of the exponential backoff, in seconds.
+        max_backoff (float): Upper bound of a single backoff delay, in seconds.
+        store (BroadcastStore, optional): Enables resuming broadcasts by ``broadcast_id``.
+
+    Example:
+        broadcaster = Broadcaster(self, concurrency=16, store=BroadcastStore())
+        results = await broadcaster.send(user_ids, 'Release 2.0 is out', broadcast_id='release-2.0')
+
+    Notes:
+        - A 429 pauses every worker until the rate limit resets and halves the concurrency;
+          it grows back by one after each ``concurrency`` successful messages in a row.
+        - With a store, recipients already sent in a previous run of the same ``broadcast_id``
+          are skipped and their stored results are returned.
+    """
+
+    def __init__(
+            self,
+            plugin,
+            concurrency: int = 8,
+            max_retries: int = 5,
+            backoff: float = 0.5,
+            max_backoff: float = 60.0,
+            store: Optional[BroadcastStore] = None
+    ):
+        if concurrency < 1:
+            raise ValueError('concurrency must be >= 1')
+
+        self.plugin = plugin
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.store = store
+
+    async def send(
+            self,
+            user_ids: Iterable[str],
+            message: str = '',
+            broadcast_id: Optional[str] = None,
+            on_progress: Optional[Callable[[int, int, BroadcastResult], Any]] = None,
+            **post_kwargs
+    ) -> dict[str, BroadcastResult]:
+        """
+        Send ``message`` to every user in ``user_ids``.
+
+        Args:
+            user_ids (Iterable[str]): Recipients; duplicates are sent once.
+            message (str): Message text.
+            broadcast_id (str, optional): Identifier used to persist and resume progress.
+            on_progress (Callable, optional): Called as ``on_progress(done, total, result)``
+                after every recipient; may be a coroutine function.
+            **post_kwargs: Extra arguments of ``direct_post`` (``props``, ``file_paths``...).
+
+        Returns:
+            dict[str, BroadcastResult]: Result per recipient, in the order of ``user_ids``.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        results: dict[str, BroadcastResult] = {}
+        if self.store is not None and broadcast_id is not None:
+            stored = await asyncio.to_thread(self.store.load, broadcast_id, user_ids)
+            results.update((user_id, result) for user_id, result in stored.items() if result.ok)
+
+        run = _BroadcastRun(self, message, post_kwargs)
+        pending = asyncio.Queue()
+        for user_id in user_ids:
+            if user_id not in results:
+                pending.put_nowait(user_id)
+
+        total = len(user_ids)
+        done = len(results)
+
+        async def worker():
+            nonlocal done
+            while True:
+                try:
+                    user_id = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+
+                result = await run.deliver(user_id)
+                results[user_id] = result
+                done += 1
+                if self.store is not None and broadcast_id is not None:
+                    await asyncio.to_thread(self.store.save, broadcast_id, [result])
+                if on_progress is not None:
+                    progress = on_progress(done, total, result)
+                    if inspect.isawaitable(progress):
+                        await progress
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, pending.qsize()))))
+        return {user_id: results[user_id] for user_id in user_ids}
+
+
+class _BroadcastRun:
+    """Concurrency gate and backoff state shared by the workers of one ``Broadcaster.send`` call."""
+
+    def __init__(self, broadcaster: Broadcaster, message: str, post_kwargs: dict):
+        self.broadcaster = broadcaster
+        self.message = message
+        self.post_kwargs = post_kwargs
+
+        self.limit = broadcaster.concurrency
+        self.active = 0
+        self.streak = 0
+        self.paused_until = 0.0
+        self.condition = asyncio.Condition()
+
+    async def deliver(self, user_id: str) -> BroadcastResult:
+        broadcaster = self.broadcaster
+        result = BroadcastResult(user_id)
+        while True:
+            result.attempts += 1
+            await self._acquire()
+            try:
+                post = await broadcaster.plugin.direct_post(
+                    receiver_id=user_id,
+                    message=self.message,
+                    **self.post_kwargs
+                )
+            except Exception as exc:
+                await self._release(success=False, rate_limit_delay=_rate_limit_delay(exc))
+                if not _is_transient(exc) or result.attempts > broadcaster.max_retries:
+                    result.error = repr(exc)
+                    return result
+
+                delay = min(broadcaster.max_backoff, broadcaster.backoff * 2 ** (result.attempts - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            else:
+                await self._release(success=True)
+                result.post_id = post['id']
+                return result
+
+    async def _acquire(self) -> None:
+        async with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.condition.release()
+                    try:
+                        await asyncio.sleep(pause)
+                    finally:
+                        await self.condition.acquire()
+                    continue
+
+                if self.active < self.limit:
+                    self.active += 1
+                    return
+                await self.condition.wait()
+
+    async def _release(self, success: bool, rate_limit_delay: Optional[float] = None) -> None:
+        async with self.condition:
+            self.active -= 1
+            if rate_limit_delay is not None:
+                self.limit = max(1, self.limit // 2)
+                self.streak = 0
+                self.paused_until = max(self.paused_until, time.monotonic() + rate_limit_delay)
+            elif success:
+                self.streak += 1
+                if self.streak >= self.limit and self.limit < self.broadcaster.concurrency:
+                    self.limit += 1
+                    self.streak = 0
+            self.condition.notify_all()
@@ -1,9 +1,17 @@
 import peewee
 import peewee_async
+from playhouse.shortcuts import ReconnectMixin
 
 pooled_database = peewee_async.PooledPostgresqlDatabase(None)
 
 
+class _SyncPostgresqlDatabase(ReconnectMixin, peewee.PostgresqlDatabase):
+    """Sync database keeping one connection per thread, reconnecting after it drops."""
+
+
+_sync_database = _SyncPostgresqlDatabase(None)
+
+
 class BaseModel(peewee.Model):
     """Base model class."""
 
@@ -15,3 +23,19 @@ class BaseModel(peewee.Model):
 
 def set_database(**kwargs):
     pooled_database.init(**kwargs)
+
+
+def sync_database() -> peewee.PostgresqlDatabase:
+    """
+    Database for synchronous queries against the server of ``pooled_database``.
+
+    Unlike ``pooled_database.allow_sync()``, which closes the connection after every
+    block, the connection is opened once per thread and reused. Pass it to the
+    query: ``query.execute(sync_database())``.
+    """
+    if (
+            _sync_database.database != pooled_database.database
+            or _sync_database.connect_params != pooled_database.connect_params
+    ):
+        _sync_database.init(pooled_database.database, **pooled_database.connect_params)
+    return _sync_database
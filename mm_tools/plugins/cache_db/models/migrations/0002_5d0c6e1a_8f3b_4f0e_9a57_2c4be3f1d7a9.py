@@ -0,0 +1,20 @@
+from peewee_moves import Migrator
+
+
+def upgrade(migrator: Migrator):
+    migrator.execute_sql(
+        '''CREATE TABLE IF NOT EXISTS plugins_sessions (
+            user_id VARCHAR(255) NOT NULL,
+            session_id VARCHAR(255) NOT NULL,
+            data JSONB NOT NULL DEFAULT '{}'::jsonb,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (user_id, session_id)
+        )'''
+    )
+    migrator.execute_sql(
+        'CREATE INDEX IF NOT EXISTS plugins_sessions_updated_at ON plugins_sessions (updated_at)'
+    )
+
+
+def downgrade(migrator: Migrator):
+    migrator.drop_table('plugins_sessions')
@@ -0,0 +1,18 @@
+from peewee_moves import Migrator
+
+
+def upgrade(migrator: Migrator):
+    migrator.execute_sql(
+        '''CREATE TABLE IF NOT EXISTS plugins_payloads (
+            key VARCHAR(255) PRIMARY KEY,
+            data BYTEA NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )'''
+    )
+    migrator.execute_sql(
+        'CREATE INDEX IF NOT EXISTS plugins_payloads_created_at ON plugins_payloads (created_at)'
+    )
+
+
+def downgrade(migrator: Migrator):
+    migrator.drop_table('plugins_payloads')
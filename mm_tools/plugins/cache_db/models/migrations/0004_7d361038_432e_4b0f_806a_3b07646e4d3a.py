@@ -0,0 +1,16 @@
+from peewee_moves import Migrator
+
+
+def upgrade(migrator: Migrator):
+    migrator.execute_sql(
+        '''CREATE TABLE IF NOT EXISTS plugins_direct_channels (
+            bot_id VARCHAR(255) NOT NULL,
+            user_id VARCHAR(255) NOT NULL,
+            channel_id VARCHAR(255) NOT NULL,
+            PRIMARY KEY (bot_id, user_id)
+        )'''
+    )
+
+
+def downgrade(migrator: Migrator):
+    migrator.drop_table('plugins_direct_channels')
@@ -0,0 +1,9 @@
+from peewee_moves import Migrator
+
+
+def upgrade(migrator: Migrator):
+    migrator.add_column('plugins_cache_state', 'state', 'text', null=True)
+
+
+def downgrade(migrator: Migrator):
+    migrator.drop_column('plugins_cache_state', 'state')
@@ -0,0 +1,23 @@
+from peewee_moves import Migrator
+
+
+def upgrade(migrator: Migrator):
+    # Keep the newest row of each user before making user_id unique.
+    migrator.execute_sql(
+        '''DELETE FROM plugins_cache_state a
+            USING plugins_cache_state b
+            WHERE a.user_id = b.user_id AND a.id < b.id'''
+    )
+    migrator.execute_sql(
+        'ALTER TABLE plugins_cache_state ALTER COLUMN cache TYPE jsonb USING cache::jsonb'
+    )
+    migrator.execute_sql(
+        'CREATE UNIQUE INDEX IF NOT EXISTS plugins_cache_state_user_id ON plugins_cache_state (user_id)'
+    )
+
+
+def downgrade(migrator: Migrator):
+    migrator.execute_sql('DROP INDEX IF EXISTS plugins_cache_state_user_id')
+    migrator.execute_sql(
+        'ALTER TABLE plugins_cache_state ALTER COLUMN cache TYPE json USING cache::json'
+    )
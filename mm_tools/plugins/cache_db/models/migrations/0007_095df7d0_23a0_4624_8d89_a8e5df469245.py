@@ -0,0 +1,14 @@
+from peewee_moves import Migrator
+
+
+def upgrade(migrator: Migrator):
+    migrator.execute_sql(
+        'ALTER TABLE plugins_cache_state ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()'
+    )
+    migrator.execute_sql(
+        'CREATE INDEX IF NOT EXISTS plugins_cache_state_updated_at ON plugins_cache_state (updated_at)'
+    )
+
+
+def downgrade(migrator: Migrator):
+    migrator.drop_column('plugins_cache_state', 'updated_at')
@@ -1,5 +1,5 @@
 import peewee
-from playhouse.postgres_ext import JSONField
+from playhouse.postgres_ext import BinaryJSONField
 
 from .base_model import BaseModel
 
@@ -7,7 +7,48 @@ from .base_model import BaseModel
 class PluginsCacheState(BaseModel):
     id = peewee.AutoField()
     user_id = peewee.CharField()
-    cache = JSONField(default={})
+    state = peewee.TextField(null=True)
+    cache = BinaryJSONField(default={}, index=False)
+    updated_at = peewee.DateTimeField(constraints=[peewee.SQL('DEFAULT now()')])
 
     class Meta:
         db_table = 'plugins_cache_state'
+
+
+# Same name as the unique index created by migration 0006.
+PluginsCacheState.add_index(peewee.ModelIndex(
+    PluginsCacheState,
+    (PluginsCacheState.user_id,),
+    unique=True,
+    name='plugins_cache_state_user_id'
+))
+
+
+class PluginsSession(BaseModel):
+    user_id = peewee.CharField()
+    session_id = peewee.CharField()
+    data = BinaryJSONField(default={})
+    updated_at = peewee.DateTimeField(constraints=[peewee.SQL('DEFAULT now()')])
+
+    class Meta:
+        db_table = 'plugins_sessions'
+        primary_key = peewee.CompositeKey('user_id', 'session_id')
+
+
+class PluginsPayload(BaseModel):
+    key = peewee.CharField(primary_key=True)
+    data = peewee.BlobField()
+    created_at = peewee.DateTimeField(constraints=[peewee.SQL('DEFAULT now()')])
+
+    class Meta:
+        db_table = 'plugins_payloads'
+
+
+class PluginsDirectChannel(BaseModel):
+    bot_id = peewee.CharField()
+    user_id = peewee.CharField()
+    channel_id = peewee.CharField()
+
+    class Meta:
+        db_table = 'plugins_direct_channels'
+        primary_key = peewee.CompositeKey('bot_id', 'user_id')
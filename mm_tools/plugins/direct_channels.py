@@ -0,0 +1,96 @@
+from typing import Awaitable, Callable
+
+from peewee_async import Manager
+
+from mm_tools.cache import LRUTTLCache
+
+from .cache_db.models.base_model import pooled_database, sync_database
+from .cache_db.models.plugins_models import PluginsDirectChannel
+
+
+class DirectChannelCache:
+    """
+    Memoized ``(bot_id, user_id) -> direct channel id`` mapping, warmed lazily.
+
+    A direct channel between two users never changes its id, so
+    ``create_direct_channel`` only has to be called once per user.
+
+    Args:
+        max_size (int): Maximum number of mappings kept in memory.
+        persistent (bool): Also keep mappings in the ``plugins_direct_channels`` table,
+            so they survive restarts and are shared between bot replicas.
+
+    Notes:
+        - With ``persistent=True`` a miss of ``get`` queries the database synchronously over
+          a per-thread connection (``sync_database()``); ``aget`` uses the async pool.
+        - ``create_direct_channel`` is idempotent, so concurrent misses for the same
+          user are not coalesced: they all resolve to the same channel id.
+    """
+
+    database_manager = Manager(pooled_database)
+
+    def __init__(self, max_size: int = 100000, persistent: bool = False):
+        self._cache = LRUTTLCache(max_size=max_size, ttl=None)
+        self.persistent = persistent
+        self.created = 0
+
+    def get(self, bot_id: str, user_id: str, loader: Callable[[], str]) -> str:
+        channel_id = self._cache.get((bot_id, user_id))
+        if channel_id is not None:
+            return channel_id
+
+        if self.persistent:
+            channel_id = self._select(bot_id, user_id).scalar(sync_database())
+
+        if channel_id is None:
+            channel_id = loader()
+            self.created += 1
+            if self.persistent:
+                self._insert(bot_id, user_id, channel_id).execute(sync_database())
+
+        self._cache.set((bot_id, user_id), channel_id)
+        return channel_id
+
+    async def aget(self, bot_id: str, user_id: str, loader: Callable[[], Awaitable[str]]) -> str:
+        channel_id = self._cache.get((bot_id, user_id))
+        if channel_id is not None:
+            return channel_id
+
+        if self.persistent:
+            channel_id = await self.database_manager.scalar(self._select(bot_id, user_id))
+
+        if channel_id is None:
+            channel_id = await loader()
+            self.created += 1
+            if self.persistent:
+                await self.database_manager.execute(self._insert(bot_id, user_id, channel_id))
+
+        self._cache.set((bot_id, user_id), channel_id)
+        return channel_id
+
+    def invalidate(self, bot_id: str, user_id: str) -> None:
+        """Drop the in-memory mapping, e.g. after the channel was archived."""
+        self._cache.pop((bot_id, user_id))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), 'created': self.created}
+
+    @staticmethod
+    def _select(bot_id: str, user_id: str):
+        return PluginsDirectChannel.select(
+            PluginsDirectChannel.channel_id
+        ).where(
+            (PluginsDirectChannel.bot_id == bot_id) &
+            (PluginsDirectChannel.user_id == user_id)
+        )
+
+    @staticmethod
+    def _insert(bot_id: str, user_id: str, channel_id: str):
+        return PluginsDirectChannel.insert(
+            bot_id=bot_id,
+            user_id=user_id,
+            channel_id=channel_id
+        ).on_conflict_ignore()
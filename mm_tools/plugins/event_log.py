@@ -0,0 +1,100 @@
+import atexit
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+from typing import Hashable
+
+
+def event_fingerprint(body: dict) -> Hashable:
+    """
+    Cheap identity of an event body.
+
+    Post events are identified by the post id and its ``update_at`` (so every edit is a
+    new event), actions by ``trigger_id``, dialog submissions by ``callback_id``,
+    ``state``, user and the submitted values. Other websocket events use ``seq`` together
+    with the broadcast target and the scalar fields of ``data``, since ``seq`` alone
+    restarts on reconnect.
+    """
+    if body.get('trigger_id'):
+        return 'action', body['trigger_id']
+
+    if 'submission' in body:
+        submission = body.get('submission') or {}
+        return (
+            'dialog',
+            body.get('callback_id'),
+            body.get('state'),
+            body.get('user_id'),
+            body.get('cancelled'),
+            tuple((key, str(value)) for key, value in submission.items()),
+        )
+
+    data = body.get('data') or {}
+    post = data.get('post')
+    if isinstance(post, dict) and post.get('id'):
+        return body.get('event'), post['id'], post.get('update_at')
+
+    broadcast = body.get('broadcast') or {}
+    return (
+        body.get('event'),
+        body.get('seq'),
+        broadcast.get('channel_id'),
+        broadcast.get('user_id'),
+        tuple((key, value) for key, value in data.items() if isinstance(value, (str, int, float, bool))),
+    )
+
+
+class RecentEvents:
+    """
+    Bounded set of recently seen event fingerprints.
+
+    Args:
+        max_size (int): Number of fingerprints remembered; the oldest one is forgotten first.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._seen: OrderedDict[Hashable, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, fingerprint: Hashable) -> bool:
+        """Remember ``fingerprint``; return False if it was already seen."""
+        with self._lock:
+            if fingerprint in self._seen:
+                self._seen.move_to_end(fingerprint)
+                return False
+
+            self._seen[fingerprint] = None
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return True
+
+
+def enable_queue_logging(logger: logging.Logger) -> QueueListener:
+    """
+    Move the handlers of ``logger`` behind a ``QueueHandler``, so formatting and I/O
+    happen in a background thread instead of the event loop.
+
+    Calling it again for the same logger returns the running listener.
+    """
+    listener = getattr(logger, '_mm_tools_queue_listener', None)
+    if listener is not None:
+        return listener
+
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *logger.handlers, respect_handler_level=True)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(records))
+
+    def stop():
+        # the listener may already have been stopped by the application
+        if listener._thread is not None:
+            listener.stop()
+
+    listener.start()
+    atexit.register(stop)
+    logger._mm_tools_queue_listener = listener
+    return listener
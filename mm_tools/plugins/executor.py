@@ -0,0 +1,119 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class BlockingCallExecutor:
+    """
+    Bounded thread pool for blocking driver calls made from async handlers.
+
+    Args:
+        max_workers (int): Maximum number of blocking calls running at once. Further calls wait in the queue.
+
+    Notes:
+        - Calls run with a copy of the caller's context, so context variables
+          (e.g. ``payload_render_scope``) are visible inside the thread.
+        - ``stats()`` reports the current queue depth and average and maximum
+          queue wait and run time.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mm-tools-blocking')
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.run_time = 0.0
+
+    def _call(self, submitted_at: float, context: contextvars.Context, func: Callable, args, kwargs) -> Any:
+        started_at = time.monotonic()
+        wait = started_at - submitted_at
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_time += wait
+            self.max_wait_time = max(self.max_wait_time, wait)
+
+        failed = False
+        try:
+            return context.run(func, *args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.run_time += time.monotonic() - started_at
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run ``func(*args, **kwargs)`` in the pool and await its result."""
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(
+            self._call,
+            time.monotonic(),
+            contextvars.copy_context(),
+            func,
+            args,
+            kwargs
+        )
+        future.add_done_callback(self._dequeue_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _dequeue_cancelled(self, future: Future) -> None:
+        # A call cancelled while still queued never reaches ``_call``
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                'max_workers': self.max_workers,
+                'queue_depth': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_ms': self.wait_time / finished * 1000 if finished else 0.0,
+                'max_wait_ms': self.max_wait_time * 1000,
+                'avg_run_ms': self.run_time / finished * 1000 if finished else 0.0,
+            }
+
+
+class AsyncPluginProxy:
+    """
+    Awaitable view of a plugin: ``await plugin.aio.direct_post(...)`` runs the blocking
+    method in the plugin's ``blocking_executor``. Coroutine methods are returned as is.
+    """
+
+    def __init__(self, plugin):
+        self._plugin = plugin
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._plugin, name)
+        if not callable(attr) or inspect.iscoroutinefunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await self._plugin.blocking_executor.run(attr, *args, **kwargs)
+
+        return wrapper
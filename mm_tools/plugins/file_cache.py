@@ -0,0 +1,171 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Optional
+
+
+class FileContentCache:
+    """
+    Content-addressed disk cache of Mattermost file contents, bounded by total size.
+
+    Contents are stored once per sha256 under ``directory``; a source file id only
+    points to its content, so the same media posted under different ids is stored once.
+    Mattermost file ids are immutable, so a cached id never goes stale.
+
+    Args:
+        directory (str): Cache directory, created if missing.
+        max_bytes (int): Total size of cached contents. The least recently used content is evicted first.
+
+    Notes:
+        - The id index lives in ``directory/ids`` so the cache survives restarts. Ids of an
+          evicted content are removed with it, and ids pointing to missing contents are
+          pruned when the cache is opened.
+        - Several processes may share the directory; eviction is per process and
+          tolerates files removed by another one.
+    """
+
+    def __init__(self, directory: str = '.file_cache', max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._ids_directory = os.path.join(directory, 'ids')
+        os.makedirs(self._ids_directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # sha256 -> size, least recently used first
+        self._blobs: OrderedDict[str, int] = OrderedDict()
+        # sha256 -> file ids pointing to it
+        self._ids: dict[str, set[str]] = {}
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        blobs = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                blobs.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, digest, size in sorted(blobs):
+            self._blobs[digest] = size
+            self._size += size
+        self._load_ids()
+        self._evict()
+
+    def _load_ids(self) -> None:
+        for entry in os.scandir(self._ids_directory):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            try:
+                with open(entry.path) as id_file:
+                    digest = id_file.read().strip()
+            except OSError:
+                continue
+
+            if digest in self._blobs:
+                self._ids.setdefault(digest, set()).add(entry.name)
+            elif not os.path.exists(self._blob_path(digest)):
+                # the content was evicted, possibly by another process
+                self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest)
+
+    def _id_path(self, file_id: str) -> str:
+        return os.path.join(self._ids_directory, file_id)
+
+    def path(self, file_id: str) -> Optional[str]:
+        """Path of the cached content of ``file_id``, or None on a miss."""
+        try:
+            with open(self._id_path(file_id)) as id_file:
+                digest = id_file.read().strip()
+        except OSError:
+            digest = None
+
+        with self._lock:
+            if digest is None or digest not in self._blobs:
+                self.misses += 1
+                return None
+            self._blobs.move_to_end(digest)
+            self.hits += 1
+
+        path = self._blob_path(digest)
+        try:
+            # mtime is the LRU order used when the cache is reopened
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._drop(digest)
+            return None
+        return path
+
+    def open(self, file_id: str) -> Optional[BinaryIO]:
+        path = self.path(file_id)
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except OSError:
+            return None
+
+    def put(self, file_id: str, content: bytes) -> str:
+        """Store ``content`` of ``file_id`` and return the path of the cached content."""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+
+        with self._lock:
+            known = digest in self._blobs
+        # another process sharing the directory may have evicted a known content
+        if not known or not os.path.exists(path):
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as blob:
+                blob.write(content)
+            os.replace(tmp_path, path)
+
+        id_tmp_path = f'{self._id_path(file_id)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(id_tmp_path, 'w') as id_file:
+            id_file.write(digest)
+        os.replace(id_tmp_path, self._id_path(file_id))
+
+        with self._lock:
+            if digest not in self._blobs:
+                self._blobs[digest] = len(content)
+                self._size += len(content)
+            self._blobs.move_to_end(digest)
+            self._ids.setdefault(digest, set()).add(file_id)
+            self._evict(keep=digest)
+        return path
+
+    def _drop(self, digest: str) -> None:
+        self._size -= self._blobs.pop(digest, 0)
+        for file_id in self._ids.pop(digest, ()):
+            self._remove(self._id_path(file_id))
+
+    def _evict(self, keep: str = None) -> None:
+        while self._size > self.max_bytes and self._blobs:
+            digest = next(iter(self._blobs))
+            if digest == keep:
+                break
+            self._drop(digest)
+            self.evictions += 1
+            self._remove(self._blob_path(digest))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'files': len(self._blobs),
+            'size_bytes': self._size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,471 @@
+import atexit
+import json
+import logging
+import threading
+from typing import Iterable, Optional
+
+import peewee
+
+from mm_tools.sessions.sessions import SQLiteConnectionPool
+from mm_tools.sql_utils import MAX_IN_PARAMS, chunks, placeholders
+
+from .cache_db.models.base_model import sync_database
+from .cache_db.models.plugins_models import PluginsCacheState
+
+logger = logging.getLogger(__name__)
+
+
+def apply_state_patch(entry: Optional[dict], patch: Optional[dict]) -> Optional[dict]:
+    """New entry with ``patch`` applied to ``entry``; a None patch deletes the entry."""
+    if patch is None:
+        return None
+
+    entry = entry or {}
+    state = patch['state'] if 'state' in patch else entry.get('state')
+    cache = {} if patch.get('reset_cache') else dict(entry.get('cache') or {})
+    cache.update(patch.get('cache') or {})
+    return {'state': state, 'cache': cache}
+
+
+def merge_state_patches(old: Optional[dict], new: Optional[dict]) -> Optional[dict]:
+    """One patch with the effect of applying ``old`` and then ``new``."""
+    if new is None:
+        return None
+    if old is None:
+        # the row is deleted first, so the merged patch has to replace all of it
+        return {'state': new.get('state'), 'reset_cache': True, 'cache': dict(new.get('cache') or {})}
+
+    merged = dict(old)
+    if 'state' in new:
+        merged['state'] = new['state']
+    if new.get('reset_cache'):
+        merged['reset_cache'] = True
+        merged['cache'] = dict(new.get('cache') or {})
+    elif new.get('cache'):
+        merged['cache'] = {**(old.get('cache') or {}), **new['cache']}
+    return merged
+
+
+def _replaces(patch: Optional[dict]) -> bool:
+    return patch is None or (bool(patch.get('reset_cache')) and 'state' in patch)
+
+
+def _is_empty(entry: dict) -> bool:
+    return not entry.get('state') and not entry.get('cache')
+
+
+class StateBackend:
+    """
+    Persistent tier of ``StateMachine``.
+
+    An entry is the dict kept per user by ``StateMachine``:
+    ``{'state': str | None, 'cache': dict}`` (both keys optional).
+
+    ``StateMachine`` writes patches rather than whole entries, so replicas sharing a
+    backend do not overwrite each other's keys. A patch is a dict with optional keys
+    ``state`` (replaces the state), ``cache`` (merged into the stored cache key by key)
+    and ``reset_cache`` (the stored cache is dropped before merging). A user left without
+    state and cache is deleted.
+
+    Backends shared between processes set ``shared = True``.
+    """
+
+    shared = False
+
+    def load(self, user_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save(self, user_id: str, entry: dict) -> None:
+        raise NotImplementedError
+
+    def delete(self, user_id: str) -> None:
+        raise NotImplementedError
+
+    def save_many(self, entries: dict[str, Optional[dict]]) -> None:
+        """Write a batch of entries; None deletes the user."""
+        for user_id, entry in entries.items():
+            if entry is None:
+                self.delete(user_id)
+            else:
+                self.save(user_id, entry)
+
+    def load_many(self, user_ids: Iterable[str]) -> dict[str, dict]:
+        """Entries of ``user_ids`` that exist in the backend."""
+        entries = {}
+        for user_id in user_ids:
+            entry = self.load(user_id)
+            if entry is not None:
+                entries[user_id] = entry
+        return entries
+
+    def patch(self, user_id: str, patch: Optional[dict]) -> None:
+        self.patch_many({user_id: patch})
+
+    def patch_many(self, patches: dict[str, Optional[dict]]) -> None:
+        """Apply a batch of patches; None deletes the user."""
+        current = self.load_many(user_id for user_id, patch in patches.items() if patch is not None)
+        entries = {}
+        for user_id, patch in patches.items():
+            entry = apply_state_patch(current.get(user_id), patch)
+            entries[user_id] = None if entry is None or _is_empty(entry) else entry
+        self.save_many(entries)
+
+    def recent_user_ids(self, within: float, limit: int = 10000) -> list[str]:
+        """Users whose entry changed during the last ``within`` seconds, most recent first."""
+        return []
+
+
+class MemoryStateBackend(StateBackend):
+    """Process-local backend; entries are lost on restart."""
+
+    def __init__(self):
+        self._entries: dict[str, dict] = {}
+
+    def load(self, user_id: str) -> Optional[dict]:
+        entry = self._entries.get(user_id)
+        return None if entry is None else apply_state_patch(entry, {})
+
+    def save(self, user_id: str, entry: dict) -> None:
+        self._entries[user_id] = apply_state_patch(entry, {})
+
+    def delete(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Backend in a local SQLite database, survives restarts of a single host.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        pool_size (int): Maximum number of open connections.
+    """
+
+    _TABLE = 'plugins_state'
+
+    def __init__(self, db_path: str = '.plugins.db', pool_size: int = 4):
+        self._pool = SQLiteConnectionPool(db_path, pool_size=pool_size)
+        with self._pool.connection() as client:
+            client.execute(
+                f'''CREATE TABLE IF NOT EXISTS {self._TABLE} (
+                    user_id TEXT PRIMARY KEY,
+                    state TEXT,
+                    cache TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )'''
+            )
+            client.commit()
+
+    def load(self, user_id: str) -> Optional[dict]:
+        with self._pool.connection() as client:
+            row = client.execute(
+                f'SELECT state, cache FROM {self._TABLE} WHERE user_id=?',
+                (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'state': row[0], 'cache': json.loads(row[1]) if row[1] else {}}
+
+    def load_many(self, user_ids: Iterable[str]) -> dict[str, dict]:
+        with self._pool.connection() as client:
+            return self._select(client, user_ids)
+
+    def _select(self, client, user_ids: Iterable[str]) -> dict[str, dict]:
+        entries = {}
+        for chunk in chunks(dict.fromkeys(user_ids), MAX_IN_PARAMS):
+            rows = client.execute(
+                f'SELECT user_id, state, cache FROM {self._TABLE} WHERE user_id IN ({placeholders(len(chunk))})',
+                chunk
+            )
+            for user_id, state, cache in rows:
+                entries[user_id] = {'state': state, 'cache': json.loads(cache) if cache else {}}
+        return entries
+
+    def recent_user_ids(self, within: float, limit: int = 10000) -> list[str]:
+        with self._pool.connection() as client:
+            rows = client.execute(
+                f'''SELECT user_id FROM {self._TABLE}
+                    WHERE updated_at >= datetime('now', ?)
+                    ORDER BY updated_at DESC LIMIT ?''',
+                (f'-{int(within)} seconds', limit)
+            )
+            return [row[0] for row in rows]
+
+    def save(self, user_id: str, entry: dict) -> None:
+        self.save_many({user_id: entry})
+
+    def delete(self, user_id: str) -> None:
+        self.save_many({user_id: None})
+
+    def save_many(self, entries: dict[str, Optional[dict]]) -> None:
+        with self._pool.connection() as client:
+            self._write(client, entries)
+            client.commit()
+
+    def patch_many(self, patches: dict[str, Optional[dict]]) -> None:
+        with self._pool.connection() as client:
+            # Take the write lock before reading, so processes sharing the file
+            # do not lose each other's patches.
+            client.execute('BEGIN IMMEDIATE')
+            current = self._select(client, patches)
+            entries = {}
+            for user_id, patch in patches.items():
+                entry = apply_state_patch(current.get(user_id), patch)
+                entries[user_id] = None if entry is None or _is_empty(entry) else entry
+            self._write(client, entries)
+            client.commit()
+
+    def _write(self, client, entries: dict[str, Optional[dict]]) -> None:
+        upserts = [
+            (user_id, entry.get('state'), json.dumps(entry.get('cache') or {}, ensure_ascii=False))
+            for user_id, entry in entries.items()
+            if entry is not None
+        ]
+        deletes = [(user_id,) for user_id, entry in entries.items() if entry is None]
+
+        if upserts:
+            client.executemany(
+                f'''INSERT INTO {self._TABLE} (user_id, state, cache, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        state=excluded.state,
+                        cache=excluded.cache,
+                        updated_at=excluded.updated_at''',
+                upserts
+            )
+        if deletes:
+            client.executemany(f'DELETE FROM {self._TABLE} WHERE user_id=?', deletes)
+
+
+class PostgresStateBackend(StateBackend):
+    """
+    Backend in the shared PostgreSQL database (``plugins_cache_state`` table), so every
+    bot replica sees the same states.
+
+    The cache is the same ``PluginsCacheState.cache`` column that
+    ``StateMachine.get_value_from_db`` / ``set_value_from_db`` work with.
+
+    Notes:
+        - ``StateMachine`` is synchronous, so queries run synchronously on ``sync_database()``,
+          which keeps one connection per thread instead of connecting on every call.
+          Write-behind moves writes to a background thread, but reads stay on the caller:
+          ``get_state`` of a user missing from the hot tier (or older than ``ttl``), e.g. in
+          every ``on_state`` check, blocks the event loop for one query round trip. Use
+          ``StateMachine.preload`` / ``warm_up`` to load users ahead of time.
+        - Patches are applied in the database (``cache || patch``), so replicas only
+          overwrite the keys they change.
+    """
+
+    shared = True
+
+    def load(self, user_id: str) -> Optional[dict]:
+        row = PluginsCacheState.select(
+            PluginsCacheState.state,
+            PluginsCacheState.cache
+        ).where(
+            PluginsCacheState.user_id == user_id
+        ).first(sync_database())
+        if row is None:
+            return None
+        return {'state': row.state, 'cache': row.cache or {}}
+
+    def load_many(self, user_ids: Iterable[str]) -> dict[str, dict]:
+        entries = {}
+        database = sync_database()
+        for chunk in chunks(dict.fromkeys(user_ids), MAX_IN_PARAMS):
+            query = PluginsCacheState.select(
+                PluginsCacheState.user_id,
+                PluginsCacheState.state,
+                PluginsCacheState.cache
+            ).where(
+                PluginsCacheState.user_id.in_(chunk)
+            )
+            for row in query.execute(database):
+                entries[row.user_id] = {'state': row.state, 'cache': row.cache or {}}
+        return entries
+
+    def recent_user_ids(self, within: float, limit: int = 10000) -> list[str]:
+        query = PluginsCacheState.select(
+            PluginsCacheState.user_id
+        ).where(
+            PluginsCacheState.updated_at >= peewee.SQL('now() - make_interval(secs => %s)', (within,))
+        ).order_by(
+            PluginsCacheState.updated_at.desc()
+        ).limit(limit)
+        return [row.user_id for row in query.execute(sync_database())]
+
+    def save(self, user_id: str, entry: dict) -> None:
+        self.save_many({user_id: entry})
+
+    def delete(self, user_id: str) -> None:
+        self.save_many({user_id: None})
+
+    def patch_many(self, patches: dict[str, Optional[dict]]) -> None:
+        # One upsert per patch shape: whether it sets the state and whether it resets the cache.
+        groups: dict[tuple[bool, bool], list[dict]] = {}
+        for user_id, patch in patches.items():
+            if patch is None:
+                continue
+            groups.setdefault(('state' in patch, bool(patch.get('reset_cache'))), []).append({
+                'user_id': user_id,
+                'state': patch.get('state'),
+                'cache': patch.get('cache') or {},
+                'updated_at': peewee.fn.now(),
+            })
+        patched = [user_id for user_id, patch in patches.items() if patch is not None]
+        deletes = [user_id for user_id, patch in patches.items() if patch is None]
+
+        database = sync_database()
+        with database.atomic():
+            for (sets_state, reset_cache), rows in groups.items():
+                update = {
+                    PluginsCacheState.cache: (
+                        peewee.EXCLUDED.cache if reset_cache
+                        else PluginsCacheState.cache.concat(peewee.EXCLUDED.cache)
+                    ),
+                    PluginsCacheState.updated_at: peewee.EXCLUDED.updated_at,
+                }
+                if sets_state:
+                    update[PluginsCacheState.state] = peewee.EXCLUDED.state
+                PluginsCacheState.insert_many(rows).on_conflict(
+                    conflict_target=[PluginsCacheState.user_id],
+                    update=update
+                ).execute(database)
+            if patched:
+                PluginsCacheState.delete().where(
+                    PluginsCacheState.user_id.in_(patched),
+                    peewee.fn.COALESCE(PluginsCacheState.state, '') == '',
+                    PluginsCacheState.cache == {}
+                ).execute(database)
+            if deletes:
+                PluginsCacheState.delete().where(PluginsCacheState.user_id.in_(deletes)).execute(database)
+
+    def save_many(self, entries: dict[str, Optional[dict]]) -> None:
+        rows = [
+            {
+                'user_id': user_id,
+                'state': entry.get('state'),
+                'cache': entry.get('cache') or {},
+                'updated_at': peewee.fn.now(),
+            }
+            for user_id, entry in entries.items()
+            if entry is not None
+        ]
+        deletes = [user_id for user_id, entry in entries.items() if entry is None]
+
+        database = sync_database()
+        with database.atomic():
+            if rows:
+                PluginsCacheState.insert_many(rows).on_conflict(
+                    conflict_target=[PluginsCacheState.user_id],
+                    update={
+                        PluginsCacheState.state: peewee.EXCLUDED.state,
+                        PluginsCacheState.cache: peewee.EXCLUDED.cache,
+                        PluginsCacheState.updated_at: peewee.EXCLUDED.updated_at,
+                    }
+                ).execute(database)
+            if deletes:
+                PluginsCacheState.delete().where(PluginsCacheState.user_id.in_(deletes)).execute(database)
+
+
+class StateWriteBehind:
+    """
+    Write-behind queue in front of a ``StateBackend``.
+
+    Patches of the same user are merged into one and flushed by a background thread
+    every ``flush_interval`` seconds (or as soon as ``max_batch`` users are pending)
+    with ``patch_many``. Pending patches are flushed on ``close`` and at interpreter exit.
+    """
+
+    def __init__(self, backend: StateBackend, flush_interval: float = 0.5, max_batch: int = 500):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self._pending: dict[str, Optional[dict]] = {}
+        self._inflight: dict[str, Optional[dict]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name='state-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def patch(self, user_id: str, patch: Optional[dict]) -> None:
+        with self._lock:
+            if user_id in self._pending:
+                patch = merge_state_patches(self._pending[user_id], patch)
+            elif patch is not None:
+                patch = merge_state_patches({}, patch)
+            self._pending[user_id] = patch
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def save(self, user_id: str, entry: dict) -> None:
+        self.patch(user_id, {
+            'state': entry.get('state'),
+            'reset_cache': True,
+            'cache': dict(entry.get('cache') or {}),
+        })
+
+    def delete(self, user_id: str) -> None:
+        self.patch(user_id, None)
+
+    def load(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            patches = [
+                queued[user_id]
+                for queued in (self._inflight, self._pending)
+                if user_id in queued
+            ]
+        # Applying a patch twice has no further effect, so the in-flight batch may or
+        # may not have reached the backend yet.
+        if patches and _replaces(patches[-1]):
+            entry = None
+        else:
+            entry = self.backend.load(user_id)
+        for patch in patches:
+            entry = apply_state_patch(entry, patch)
+        return entry
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch:
+                return
+
+            try:
+                self.backend.patch_many(batch)
+            except Exception:
+                with self._lock:
+                    for user_id, patch in batch.items():
+                        if user_id in self._pending:
+                            patch = merge_state_patches(patch, self._pending[user_id])
+                        self._pending[user_id] = patch
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush state writes')
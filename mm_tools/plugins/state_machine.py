@@ -1,42 +1,222 @@
 import asyncio
-from functools import wraps
+import atexit
+import logging
+import time
+from functools import lru_cache, partial, wraps
+from typing import Iterable
 
+import peewee
 from peewee_async import Manager
 
 from .cache_db.models.base_model import pooled_database
 from .cache_db.models.plugins_models import PluginsCacheState
+from mm_tools.sql_utils import MAX_IN_PARAMS, chunks
+
+from .state_backends import StateBackend, StateWriteBehind, apply_state_patch, merge_state_patches
+from .state_store import BoundedStateStore, _entry_size
+
+logger = logging.getLogger(__name__)
+
+# Время загрузки записи из backend, хранится в самой записи
+_LOADED_AT = 'loaded_at'
 
 
 class StateMachine:
+    """Состояния и кэш пользователей плагинов.
+
+    Без ``backend`` данные живут только в памяти процесса (общий для всех
+    экземпляров словарь ``state_data``). С ``backend`` у экземпляра свой
+    горячий словарь, промах читается из постоянного хранилища один раз,
+    а изменения пишутся в него сразу (write-through) или фоновым потоком
+    пачками (``write_behind=True``). В ``backend`` уходят не записи целиком,
+    а изменённые поля: ``set_state`` пишет только состояние, ``set_value`` —
+    ``cache || patch``, поэтому реплики не затирают ключи друг друга.
+
+    ``ttl`` — через сколько секунд запись, загруженная из ``backend``,
+    перечитывается при следующем обращении, чтобы увидеть изменения других
+    реплик; для общего между процессами ``backend`` (``backend.shared``)
+    он обязателен. Промах и перечитывание — синхронный запрос в ``backend``
+    из вызывающего потока, то есть из event loop.
+
+    ``max_users``/``idle_ttl`` ограничивают горячий словарь
+    (``BoundedStateStore``): давно неактивные пользователи вытесняются.
+    С ``spill_only=True`` изменения не пишутся в ``backend`` на каждый
+    вызов — туда сбрасываются только вытесненные записи и, на ``flush()``
+    и при завершении процесса, все изменённые.
+
+    Записи меняются на месте; пользователь без состояния и кэша удаляется
+    из памяти (с ``backend`` остаётся пустая запись, чтобы не ходить в базу
+    повторно).
+    """
+
     state_data = {}
     db_name = '.plugins.db'
     database_manager = Manager(pooled_database)
 
+    def __init__(
+            self,
+            backend: StateBackend = None,
+            write_behind: bool = False,
+            max_users: int = None,
+            idle_ttl: float = None,
+            spill_only: bool = False,
+            ttl: float = None
+    ):
+        if spill_only and backend is None:
+            raise ValueError('spill_only requires a backend')
+        if backend is not None and backend.shared and ttl is None:
+            raise ValueError('a shared backend requires ttl')
+
+        self.backend = backend
+        self.spill_only = spill_only
+        self.ttl = ttl
+        self._writer = None
+        # user_id -> патч, ещё не записанный в backend (spill_only)
+        self._dirty: dict[str, dict] = {}
+        if backend is not None:
+            self.state_data = {}
+            self._writer = StateWriteBehind(backend) if write_behind else backend
+        if max_users is not None or idle_ttl is not None:
+            self.state_data = BoundedStateStore(
+                max_users=max_users,
+                idle_ttl=idle_ttl,
+                on_evict=self._evicted if spill_only else None
+            )
+        if spill_only:
+            atexit.register(self.flush)
+
+    def _stale(self, entry: dict) -> bool:
+        if self.ttl is None or self._writer is None:
+            return False
+        return _LOADED_AT not in entry or time.monotonic() - entry[_LOADED_AT] > self.ttl
+
+    def _loaded(self, user_id: str, entry: dict | None) -> dict:
+        pending = self._dirty.get(user_id)
+        if pending is not None:
+            entry = apply_state_patch(entry, pending)
+        entry = entry or {}
+        entry[_LOADED_AT] = time.monotonic()
+        self.state_data[user_id] = entry
+        return entry
+
+    def _entry(self, user_id: str, create: bool = False) -> dict:
+        entry = self.state_data.get(user_id)
+        if entry is not None and self._stale(entry):
+            entry = None
+        if entry is None and self._writer is not None:
+            entry = self._loaded(user_id, self._writer.load(user_id))
+        if entry is None:
+            entry = {}
+            if create:
+                self.state_data[user_id] = entry
+        return entry
+
+    def _changed(self, user_id: str, entry: dict, patch: dict) -> None:
+        if not entry.get('state') and not entry.get('cache'):
+            entry.pop('state', None)
+            entry.pop('cache', None)
+            if self._writer is None:
+                self.state_data.pop(user_id, None)
+                return
+
+        if self._writer is None:
+            return
+        if self.spill_only:
+            self._dirty[user_id] = merge_state_patches(self._dirty.get(user_id, {}), patch)
+        else:
+            self._writer.patch(user_id, patch)
+
+    def _spill(self, user_id: str) -> None:
+        patch = self._dirty.get(user_id)
+        if patch is None:
+            return
+        # Патч убирается только после успешной записи, иначе он повторится на flush()
+        self._writer.patch(user_id, patch)
+        if self._dirty.get(user_id) is patch:
+            del self._dirty[user_id]
+
+    def _evicted(self, user_id: str, entry: dict) -> None:
+        # Вытеснение происходит внутри вызова другого пользователя, ошибка записи не должна его ломать
+        try:
+            self._spill(user_id)
+        except Exception:
+            logger.exception('Failed to spill state of %s', user_id)
+
+    def flush(self) -> None:
+        """Дописать отложенные изменения в ``backend``."""
+        if self.spill_only:
+            for user_id in list(self._dirty):
+                self._spill(user_id)
+        if isinstance(self._writer, StateWriteBehind):
+            self._writer.flush()
+
+    def preload(self, user_ids: Iterable[str]) -> int:
+        """Загрузить из ``backend`` записи пользователей, которых ещё нет в памяти.
+
+        Запросы идут пачками ``WHERE user_id IN (...)``; возвращает число загруженных записей.
+        """
+        if self._writer is None:
+            return 0
+        if isinstance(self._writer, StateWriteBehind):
+            self._writer.flush()
+
+        missing = [user_id for user_id in dict.fromkeys(user_ids) if self.state_data.get(user_id) is None]
+        entries = self.backend.load_many(missing)
+        for user_id, entry in entries.items():
+            self._loaded(user_id, entry)
+        return len(entries)
+
+    def warm_up(self, active_within: float, limit: int = 10000) -> int:
+        """Предзагрузить пользователей, менявших состояние за последние ``active_within`` секунд."""
+        if self.backend is None:
+            return 0
+        return self.preload(self.backend.recent_user_ids(active_within, limit))
+
+    def last_access(self, user_id: str) -> float | None:
+        """``time.monotonic()`` последнего обращения (только с ``max_users``/``idle_ttl``)."""
+        if isinstance(self.state_data, BoundedStateStore):
+            return self.state_data.last_access(user_id)
+        return None
+
+    def stats(self) -> dict:
+        if isinstance(self.state_data, BoundedStateStore):
+            stats = self.state_data.stats()
+        else:
+            stats = {
+                'users': len(self.state_data),
+                'approx_bytes': sum(_entry_size(entry) for entry in list(self.state_data.values())),
+            }
+        stats['dirty'] = len(self._dirty)
+        return stats
+
     def set_state(self, user_id: str, state: str | None) -> None:
-        self.state_data[user_id] = {
-            **self.state_data.get(user_id, {}),
-            'state': state,
-        }
+        entry = self._entry(user_id, create=True)
+        entry['state'] = state
+        self._changed(user_id, entry, {'state': state})
 
     def state_finish(self, user_id: str) -> None:
         self.set_state(user_id, None)
 
     def get_state(self, user_id: str) -> str | None:
-        return self.state_data.get(user_id, {}).get('state')
+        return self._entry(user_id).get('state')
 
     def set_value(self, user_id: str, **kwargs) -> None:
-        old_cache = self.state_data.get(user_id, {}).get('cache', {})
-        self.state_data[user_id] = {
-            **self.state_data.get(user_id, {}),
-            'cache': {**old_cache, **kwargs},
-        }
+        entry = self._entry(user_id, create=True)
+        cache = entry.get('cache')
+        if cache is None:
+            cache = entry['cache'] = {}
+        cache.update(kwargs)
+        self._changed(user_id, entry, {'cache': kwargs})
 
     def get_value(self, user_id: str):
-        return self.state_data.get(user_id, {}).get('cache', {})
+        return self._entry(user_id).get('cache', {})
 
     def clear_values(self, user_id):
-        if self.get_value(user_id):
-            self.state_data[user_id].pop('cache')
+        entry = self._entry(user_id)
+        # С backend кэш мог записать другой процесс, поэтому сброс уходит всегда
+        if entry.get('cache') or self._writer is not None:
+            entry.pop('cache', None)
+            self._changed(user_id, entry, {'reset_cache': True})
 
     @staticmethod
     def init_tables():
@@ -49,21 +229,40 @@ class StateMachine:
         ).where(
             PluginsCacheState.user_id == user_id
         )
-        if await StateMachine.database_manager.count(query) > 0:
+        for data in await StateMachine.database_manager.execute(query):
+            return data.cache
+
+    @staticmethod
+    async def get_values_from_db(user_ids: Iterable[str]) -> dict[str, dict]:
+        """Кэши нескольких пользователей пачками ``WHERE user_id IN (...)``: {user_id: cache}."""
+        values = {}
+        for chunk in chunks(dict.fromkeys(user_ids), MAX_IN_PARAMS):
+            query = PluginsCacheState.select(
+                PluginsCacheState.user_id,
+                PluginsCacheState.cache
+            ).where(
+                PluginsCacheState.user_id.in_(chunk)
+            )
             for data in await StateMachine.database_manager.execute(query):
-                return data.cache
+                values[data.user_id] = data.cache
+        return values
 
     @staticmethod
     async def set_value_from_db(user_id: str, **kw):
-        old_value = await StateMachine.get_value_from_db(user_id)
-        new_value = {**(old_value or {}), **kw}
-
-        cache, _ = await StateMachine.database_manager.get_or_create(
-            PluginsCacheState,
-            user_id=user_id
+        """Дописать ключи в кэш одним ``INSERT ... ON CONFLICT`` (``cache || patch`` в базе)."""
+        await StateMachine.database_manager.execute(
+            PluginsCacheState.insert(
+                user_id=user_id,
+                cache=kw,
+                updated_at=peewee.fn.now()
+            ).on_conflict(
+                conflict_target=[PluginsCacheState.user_id],
+                update={
+                    PluginsCacheState.cache: PluginsCacheState.cache.concat(peewee.EXCLUDED.cache),
+                    PluginsCacheState.updated_at: peewee.fn.now()
+                }
+            )
         )
-        cache.cache = new_value
-        cache.save()
 
     @staticmethod
     async def clear_values_from_db(user_id: str):
@@ -75,34 +274,123 @@ class StateMachine:
 
     @staticmethod
     async def clear_value_from_db(user_id: str, key_value: str):
-        old_value = await StateMachine.get_value_from_db(user_id)
-        old_value.pop(key_value)
+        await StateMachine.database_manager.execute(
+            PluginsCacheState.update(
+                cache=PluginsCacheState.cache.remove(key_value),
+                updated_at=peewee.fn.now()
+            ).where(
+                PluginsCacheState.user_id == user_id
+            )
+        )
+
 
-        await StateMachine.set_value_from_db(user_id, **old_value)
+def _match_states(states: tuple, state_db: str | None) -> bool:
+    for state in states:
+        if not state:
+            return not state_db
+
+        if state in (state_db or ''):
+            return True
+    return False
 
 
 def on_state(states: list):
+    states = tuple(states)
+
     def decorator(func):
+        # Результат проверки зависит только от state_db, поэтому запоминается
+        matches = lru_cache(maxsize=1024)(partial(_match_states, states))
+
         @wraps(func)
         async def wrapper(
                 plugin,
                 message_or_event
         ):
-            state_db = plugin.state.get_state(message_or_event.user_id)
+            if matches(plugin.state.get_state(message_or_event.user_id)):
+                return await func(plugin, message_or_event)
+
+        return wrapper
+
+    return decorator
 
+
+class StateRouter:
+    """Индекс обработчиков по состояниям: один поиск на сообщение вместо проверки каждого обработчика.
+
+    Состояния разбиваются на сегменты по ``separator`` и складываются в trie.
+    Обработчик состояния ``order`` получает и ``order``, и вложенные
+    ``order:address``, ``order:address:city``; если есть обработчик
+    точнее, вызываются только обработчики самого точного состояния.
+    Если на одно состояние зарегистрировано несколько обработчиков,
+    ``dispatch`` вызывает их все по порядку регистрации. Обработчики
+    с пустым состоянием (``None``/``''``) вызываются для пользователей
+    без состояния.
+
+    В отличие от ``on_state`` совпадение ищется по префиксу сегментов,
+    а не по подстроке.
+
+    Пример::
+
+        router = StateRouter()
+
+        class OrderPlugin(BasePlugin):
+            @listen_to('.*')
+            async def on_message(self, message):
+                await router.dispatch(self, message)
+
+            @router.on_state(['order:address'])
+            async def address(self, message):
+                ...
+    """
+
+    def __init__(self, separator: str = ':'):
+        self.separator = separator
+        self._root: dict = {'handlers': [], 'children': {}}
+        self._empty: list = []
+        self._match = lru_cache(maxsize=4096)(self._lookup)
+
+    def on_state(self, states: list):
+        def decorator(func):
             for state in states:
-                if not state and not state_db:
-                    return await func(plugin, message_or_event)
+                self.add(state, func)
+            return func
 
-                if not state and state_db:
-                    return
+        return decorator
 
-                if state in (state_db or ''):
-                    return await func(plugin, message_or_event)
+    def add(self, state: str | None, handler) -> None:
+        if not state:
+            if handler not in self._empty:
+                self._empty.append(handler)
+        else:
+            node = self._root
+            for segment in state.split(self.separator):
+                node = node['children'].setdefault(segment, {'handlers': [], 'children': {}})
+            if handler not in node['handlers']:
+                node['handlers'].append(handler)
+        self._match.cache_clear()
 
-        return wrapper
+    def _lookup(self, state_db: str | None) -> tuple:
+        if not state_db:
+            return tuple(self._empty)
 
-    return decorator
+        node = self._root
+        handlers = ()
+        for segment in state_db.split(self.separator):
+            node = node['children'].get(segment)
+            if node is None:
+                break
+            if node['handlers']:
+                handlers = tuple(node['handlers'])
+        return handlers
+
+    def match(self, state_db: str | None) -> tuple:
+        """Обработчики самого точного зарегистрированного состояния для ``state_db``."""
+        return self._match(state_db)
+
+    async def dispatch(self, plugin, message_or_event) -> list:
+        """Вызывает обработчики найденного состояния по очереди и возвращает их результаты."""
+        handlers = self._match(plugin.state.get_state(message_or_event.user_id))
+        return [await handler(plugin, message_or_event) for handler in handlers]
 
 
 def on_filter(filters: list):
@@ -0,0 +1,142 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+def _entry_size(entry: dict) -> int:
+    size = sys.getsizeof(entry)
+    for key, value in entry.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, dict):
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return size
+
+
+class BoundedStateStore:
+    """
+    Hot tier of ``StateMachine`` bounded by user count (LRU) and idle time.
+
+    Entries are mutable and updated in place; every read or write refreshes the
+    user's last access, so ``idle_ttl`` evicts users that have not touched the bot
+    for that long.
+
+    Args:
+        max_users (int, optional): Maximum number of users kept in memory. None disables the limit.
+        idle_ttl (float, optional): Seconds since the last access after which a user is dropped.
+        on_evict (Callable[[str, dict], None], optional): Called with every entry dropped by the
+            size limit or idle expiry, e.g. to spill it to a database.
+
+    Notes:
+        - Idle users are dropped lazily: when they are read, and from the least recently
+          used end whenever an entry is written.
+        - ``stats()['approx_bytes']`` walks all entries and is meant for occasional monitoring.
+    """
+
+    def __init__(
+            self,
+            max_users: Optional[int] = 10000,
+            idle_ttl: Optional[float] = None,
+            on_evict: Callable[[str, dict], None] = None
+    ):
+        if max_users is not None and max_users < 1:
+            raise ValueError('max_users must be >= 1')
+
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        # user_id -> [last access, entry], least recently used first
+        self._data: OrderedDict[str, list] = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, last_access: float, now: float) -> bool:
+        return bool(self.idle_ttl) and now - last_access > self.idle_ttl
+
+    def _drop(self, user_id: str, entry: dict) -> None:
+        if self.on_evict is not None:
+            self.on_evict(user_id, entry)
+
+    def get(self, user_id: str, default: Optional[dict] = None) -> Optional[dict]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is None:
+                self.misses += 1
+                return default
+
+            if not self._expired(item[0], now):
+                item[0] = now
+                self._data.move_to_end(user_id)
+                self.hits += 1
+                return item[1]
+
+            del self._data[user_id]
+            self.expirations += 1
+            self.misses += 1
+
+        # on_evict may do I/O, so it runs outside the lock
+        self._drop(user_id, item[1])
+        return default
+
+    def __setitem__(self, user_id: str, entry: dict) -> None:
+        now = time.monotonic()
+        dropped = []
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is None:
+                self._data[user_id] = [now, entry]
+            else:
+                item[0], item[1] = now, entry
+                self._data.move_to_end(user_id)
+
+            while self._data:
+                oldest_id, (last_access, oldest) = next(iter(self._data.items()))
+                if self._expired(last_access, now):
+                    self.expirations += 1
+                elif self.max_users is not None and len(self._data) > self.max_users:
+                    self.evictions += 1
+                else:
+                    break
+                del self._data[oldest_id]
+                dropped.append((oldest_id, oldest))
+
+        for oldest_id, oldest in dropped:
+            self._drop(oldest_id, oldest)
+
+    def pop(self, user_id: str, default: Optional[dict] = None) -> Optional[dict]:
+        with self._lock:
+            item = self._data.pop(user_id, None)
+        return default if item is None else item[1]
+
+    def last_access(self, user_id: str) -> Optional[float]:
+        """``time.monotonic()`` of the user's last access, None if the user is not in memory."""
+        item = self._data.get(user_id)
+        return item[0] if item else None
+
+    def items(self) -> list[tuple[str, dict]]:
+        with self._lock:
+            return [(user_id, item[1]) for user_id, item in self._data.items()]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            approx_bytes = sum(_entry_size(item[1]) for item in self._data.values())
+        lookups = self.hits + self.misses
+        return {
+            'users': len(self._data),
+            'max_users': self.max_users,
+            'approx_bytes': approx_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, Iterable, Optional
+
+from mm_tools.cache import LRUTTLCache
+
+
+class UserCache:
+    """
+    Bounded LRU + TTL cache of Mattermost user objects, shared by plugin instances.
+
+    Concurrent lookups of the same missing user are coalesced into one API call
+    (single-flight), both for threads (``fetch``) and coroutines (``afetch``).
+
+    Args:
+        max_size (int): Maximum number of cached users.
+        ttl (float, optional): Seconds a user object stays valid. None disables expiry.
+
+    Notes:
+        - Cached user dicts are shared between callers and must not be mutated.
+        - Feed websocket events to ``handle_event`` to drop users as soon as they change.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = 600):
+        self._cache = LRUTTLCache(max_size=max_size, ttl=ttl)
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.fetches = 0
+        self.coalesced = 0
+
+    def get(self, user_id: str) -> Optional[dict]:
+        return self._cache.get(user_id)
+
+    def set(self, user_id: str, user_info: dict) -> None:
+        self._cache.set(user_id, user_info)
+
+    def get_many(self, user_ids: Iterable[str]) -> tuple[dict[str, dict], list[str]]:
+        """Split ``user_ids`` into cached users and ids that still have to be fetched."""
+        found, missing = {}, []
+        for user_id in user_ids:
+            user_info = self._cache.get(user_id)
+            if user_info is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = user_info
+
+        self.hits += len(found)
+        return found, missing
+
+    def set_many(self, users: Iterable[dict]) -> None:
+        """Cache user objects returned by a bulk API call."""
+        for user_info in users:
+            self.fetches += 1
+            self._cache.set(user_info['id'], user_info)
+
+    def invalidate(self, user_id: str) -> None:
+        self._cache.pop(user_id)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def handle_event(self, body: dict) -> None:
+        """Invalidate cached users on ``user_updated`` websocket events."""
+        if body.get('event') != 'user_updated':
+            return
+
+        user = body.get('data', {}).get('user') or {}
+        if user.get('id'):
+            self.invalidate(user['id'])
+
+    def fetch(self, user_id: str, loader: Callable[[str], dict]) -> dict:
+        user_info = self._cache.get(user_id)
+        if user_info is not None:
+            self.hits += 1
+            return user_info
+
+        with self._locks_guard:
+            lock = self._locks.setdefault(user_id, threading.Lock())
+            contended = lock.locked()
+
+        try:
+            with lock:
+                if contended:
+                    user_info = self._cache.get(user_id)
+                    if user_info is not None:
+                        self.coalesced += 1
+                        return user_info
+
+                user_info = loader(user_id)
+                self.fetches += 1
+                self._cache.set(user_id, user_info)
+                return user_info
+        finally:
+            with self._locks_guard:
+                if not lock.locked():
+                    self._locks.pop(user_id, None)
+
+    async def afetch(self, user_id: str, loader: Callable[[str], Awaitable[dict]]) -> dict:
+        user_info = self._cache.get(user_id)
+        if user_info is not None:
+            self.hits += 1
+            return user_info
+
+        task = self._inflight.get(user_id)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        # The loader runs in its own task, so cancelling any caller (the first one
+        # included) does not cancel the fetch the other callers are waiting for.
+        task = asyncio.get_running_loop().create_task(self._aload(user_id, loader))
+        self._inflight[user_id] = task
+        task.add_done_callback(lambda done: self._afetch_done(user_id, done))
+        return await asyncio.shield(task)
+
+    async def _aload(self, user_id: str, loader: Callable[[str], Awaitable[dict]]) -> dict:
+        user_info = await loader(user_id)
+        self.fetches += 1
+        self._cache.set(user_id, user_info)
+        return user_info
+
+    def _afetch_done(self, user_id: str, task: asyncio.Task) -> None:
+        if self._inflight.get(user_id) is task:
+            del self._inflight[user_id]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every caller was cancelled.
+            task.exception()
+
+    def stats(self) -> dict:
+        """Lookup counters: ``fetches`` went to the API, ``coalesced`` waited for another caller's fetch."""
+        cache_stats = self._cache.stats()
+        lookups = self.hits + self.coalesced + self.fetches
+        return {
+            'size': cache_stats['size'],
+            'max_size': cache_stats['max_size'],
+            'hits': self.hits,
+            'coalesced': self.coalesced,
+            'fetches': self.fetches,
+            'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            'evictions': cache_stats['evictions'],
+            'expirations': cache_stats['expirations'],
+        }
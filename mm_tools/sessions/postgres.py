@@ -0,0 +1,169 @@
+from typing import AsyncIterator, Iterable
+
+import peewee
+from peewee_async import Manager
+
+from mm_tools.plugins.cache_db.models.base_model import pooled_database
+from mm_tools.plugins.cache_db.models.plugins_models import PluginsSession
+
+from .sessions import AsyncBaseSession
+
+
+class PostgresSession(AsyncBaseSession):
+    """Хранение состояния диалога в PostgreSQL.
+
+    Работает через общий ``pooled_database`` (peewee-async), поэтому
+    сессии доступны всем репликам бота, подключённым к одной базе.
+    Данные лежат в JSONB-колонке таблицы ``plugins_sessions``
+    (см. миграцию ``0002``), запись — один ``INSERT ... ON CONFLICT``,
+    ``update`` дописывает ключи оператором ``||`` на стороне базы.
+    """
+
+    database_manager = Manager(pooled_database)
+
+    def _where(self):
+        return (
+            (PluginsSession.user_id == self.user_id) &
+            (PluginsSession.session_id == self.session_id)
+        )
+
+    async def get(self) -> dict:
+        query = PluginsSession.select(
+            PluginsSession.data
+        ).where(
+            self._where()
+        )
+        for row in await self.database_manager.execute(query):
+            return row.data or {}
+        return {}
+
+    async def get_all(self) -> list[dict]:
+        query = PluginsSession.select(
+            PluginsSession.data
+        ).where(
+            PluginsSession.user_id == self.user_id
+        )
+        return [row.data for row in await self.database_manager.execute(query)]
+
+    async def set(self, data: dict) -> None:
+        if not isinstance(data, dict):
+            raise TypeError('Session data must be dict')
+
+        await self.database_manager.execute(
+            PluginsSession.insert(
+                user_id=self.user_id,
+                session_id=self.session_id,
+                data=data,
+                updated_at=peewee.fn.now()
+            ).on_conflict(
+                conflict_target=[PluginsSession.user_id, PluginsSession.session_id],
+                preserve=[PluginsSession.data],
+                update={PluginsSession.updated_at: peewee.fn.now()}
+            )
+        )
+
+    async def get_key(self, key: str, default=None):
+        query = PluginsSession.select(
+            PluginsSession.data[key].as_json().alias('value'),
+            PluginsSession.data.has_key(key).alias('found')
+        ).where(
+            self._where()
+        )
+        for row in await self.database_manager.execute(query):
+            return row.value if row.found else default
+        return default
+
+    async def update(self, **values) -> None:
+        if not values:
+            return
+
+        await self.database_manager.execute(
+            PluginsSession.insert(
+                user_id=self.user_id,
+                session_id=self.session_id,
+                data=values,
+                updated_at=peewee.fn.now()
+            ).on_conflict(
+                conflict_target=[PluginsSession.user_id, PluginsSession.session_id],
+                update={
+                    PluginsSession.data: PluginsSession.data.concat(peewee.EXCLUDED.data),
+                    PluginsSession.updated_at: peewee.fn.now()
+                }
+            )
+        )
+
+    async def pop(self, key: str, default=None):
+        async with self.database_manager.atomic():
+            query = PluginsSession.select(
+                PluginsSession.data[key].as_json().alias('value'),
+                PluginsSession.data.has_key(key).alias('found')
+            ).where(
+                self._where()
+            ).for_update()
+            rows = list(await self.database_manager.execute(query))
+            if not rows or not rows[0].found:
+                return default
+
+            await self.database_manager.execute(
+                PluginsSession.update(
+                    data=PluginsSession.data.remove(key),
+                    updated_at=peewee.fn.now()
+                ).where(
+                    self._where()
+                )
+            )
+            return rows[0].value
+
+    async def iter_all(self, batch_size: int = 500) -> AsyncIterator[dict]:
+        last_session_id = ''
+        while True:
+            query = PluginsSession.select(
+                PluginsSession.session_id,
+                PluginsSession.data
+            ).where(
+                (PluginsSession.user_id == self.user_id) &
+                (PluginsSession.session_id > last_session_id)
+            ).order_by(
+                PluginsSession.session_id
+            ).limit(batch_size)
+            rows = list(await self.database_manager.execute(query))
+
+            for row in rows:
+                yield row.data or {}
+
+            if len(rows) < batch_size:
+                return
+            last_session_id = rows[-1].session_id
+
+    @classmethod
+    async def get_many(cls, user_ids: Iterable[str]) -> dict[str, list[dict]]:
+        query = PluginsSession.select(
+            PluginsSession.user_id,
+            PluginsSession.data
+        ).where(
+            PluginsSession.user_id.in_(list(set(user_ids)))
+        )
+        result = {}
+        for row in await cls.database_manager.execute(query):
+            result.setdefault(row.user_id, []).append(row.data or {})
+        return result
+
+    @classmethod
+    async def clear_many(cls, user_ids: Iterable[str]) -> None:
+        await cls.database_manager.execute(
+            PluginsSession.delete().where(
+                PluginsSession.user_id.in_(list(set(user_ids)))
+            )
+        )
+
+    async def clear(self) -> None:
+        await self.database_manager.execute(
+            PluginsSession.delete().where(self._where())
+        )
+
+    async def clear_all_sessions(self) -> None:
+        await self.database_manager.execute(
+            PluginsSession.delete().where(
+                PluginsSession.user_id == self.user_id
+            )
+        )
@@ -1,16 +1,454 @@
+from contextlib import contextmanager
 from functools import wraps
 from uuid import uuid4
 
+import asyncio
+import atexit
+import copy
+import logging
+import queue
 import sqlite3
 import json
 import threading
-from typing import Optional
+import time
+import weakref
+import zlib
+from typing import AsyncIterator, Iterable, Iterator, Optional, Union
+
+import aiosqlite
+import msgpack
+
+from mm_tools.cache import LRUTTLCache
+from mm_tools.sql_utils import MAX_IN_PARAMS, chunks, placeholders
+
+logger = logging.getLogger(__name__)
 
 
 def generate_session_id() -> str:
     return str(uuid4())
 
 
+class SQLiteConnectionPool:
+    """Пул долгоживущих соединений к одной SQLite базе.
+
+    Соединения открываются лениво (не более ``pool_size``), один раз
+    настраиваются PRAGMA и переиспользуются между вызовами, поэтому кэш
+    подготовленных выражений sqlite3 (``cached_statements``) тоже живёт
+    между обработчиками. Если все соединения заняты, ``connection()``
+    ждёт освобождения одного из них. ``pragmas`` выполняются на каждом
+    новом соединении до перевода базы в WAL.
+    """
+
+    def __init__(
+            self,
+            db_path: str,
+            pool_size: int = 4,
+            cached_statements: int = 256,
+            pragmas: tuple[str, ...] = (),
+            on_connect=None
+    ):
+        if pool_size < 1:
+            raise ValueError('pool_size must be >= 1')
+
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.cached_statements = cached_statements
+        self.pragmas = pragmas
+        self._on_connect = on_connect
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        for pragma in self.pragmas:
+            conn.execute(f'PRAGMA {pragma};')
+        conn.execute('PRAGMA journal_mode=WAL;')
+        conn.execute('PRAGMA foreign_keys=ON;')
+        if self._on_connect:
+            self._on_connect(conn)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.pool_size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_MSGPACK_HEADER = b'\x01'
+_MSGPACK_ZLIB_HEADER = b'\x02'
+
+
+def decode_session_data(raw: Union[str, bytes]) -> dict:
+    """Декодировать значение колонки ``data`` любым из поддерживаемых форматов.
+
+    TEXT — JSON (в том числе строки, записанные до появления кодеков),
+    BLOB — msgpack с однобайтовым заголовком, возможно сжатый zlib.
+    """
+    if isinstance(raw, str):
+        return json.loads(raw)
+
+    raw = bytes(raw)
+    header, body = raw[:1], raw[1:]
+    if header == _MSGPACK_HEADER:
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    if header == _MSGPACK_ZLIB_HEADER:
+        return msgpack.unpackb(zlib.decompress(body), raw=False, strict_map_key=False)
+    return json.loads(raw)
+
+
+class SessionCodec:
+    """Формат хранения данных сессии в колонке ``data``.
+
+    ``decode`` понимает все форматы, поэтому смена кодека не требует
+    миграции уже записанных строк.
+    """
+
+    def encode(self, data: dict) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def decode(self, raw: Union[str, bytes]) -> dict:
+        return decode_session_data(raw)
+
+
+class JSONCodec(SessionCodec):
+    def encode(self, data: dict) -> str:
+        return json.dumps(data, ensure_ascii=False)
+
+
+class MsgpackCodec(SessionCodec):
+    """msgpack в BLOB; payload от ``compress_threshold`` байт сжимается zlib."""
+
+    def __init__(self, compress_threshold: Optional[int] = 1024, compress_level: int = 6):
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def encode(self, data: dict) -> bytes:
+        packed = msgpack.packb(data, use_bin_type=True)
+        if self.compress_threshold is not None and len(packed) >= self.compress_threshold:
+            return _MSGPACK_ZLIB_HEADER + zlib.compress(packed, self.compress_level)
+        return _MSGPACK_HEADER + packed
+
+
+def _json_path(key: str) -> Optional[str]:
+    """JSON1-путь к ключу верхнего уровня или None, если ключ нельзя записать путём.
+
+    JSON1 сравнивает метку пути с ключом без разбора экранирования, поэтому
+    ключи с кавычками, обратной косой чертой и управляющими символами
+    обрабатываются через чтение и перезапись всего dict.
+    """
+    if any(char in '"\\' or char < ' ' or char == '\x7f' for char in key):
+        return None
+    return f'$."{key}"'
+
+
+def _json1_value(json_type: str, value):
+    if json_type in ('object', 'array'):
+        return json.loads(value)
+    if json_type == 'true':
+        return True
+    if json_type == 'false':
+        return False
+    if json_type == 'null':
+        return None
+    return value
+
+
+_DELETED = object()
+
+
+class SessionWriteBuffer:
+    """Отложенная запись (write-behind) изменений сессий с групповым коммитом.
+
+    ``put``/``delete`` только ставят изменение в очередь, повторные изменения
+    одной ``(user_id, session_id)`` схлопываются до последнего. Фоновый поток
+    записывает очередь одной транзакцией раз в ``flush_interval`` секунд или
+    сразу, как только накопилось ``max_batch`` изменений. Незаписанные
+    изменения видны через ``lookup``, а при завершении процесса (``atexit``)
+    или вызове ``close`` очередь гарантированно сбрасывается в базу.
+    """
+
+    def __init__(
+            self,
+            pool: SQLiteConnectionPool,
+            table: str,
+            upsert_sql: str,
+            flush_interval: float = 0.05,
+            max_batch: int = 100
+    ):
+        self._pool = pool
+        self._table = table
+        self._upsert_sql = upsert_sql
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self._pending: dict[tuple[str, str], object] = {}
+        self._inflight: dict[tuple[str, str], object] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name='session-write-behind',
+            daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, user_id: str, session_id: str, payload: Union[str, bytes]) -> None:
+        if self._closed:
+            raise RuntimeError('Session write buffer is closed')
+
+        with self._lock:
+            self._pending[(user_id, session_id)] = payload
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def delete(self, user_id: str, session_id: str) -> None:
+        self.put(user_id, session_id, _DELETED)
+
+    def lookup(self, user_id: str, session_id: str) -> tuple[bool, Optional[Union[str, bytes]]]:
+        """Вернуть ``(True, payload)`` для ещё не записанного изменения.
+
+        Для удалённой сессии ``payload`` равен ``None``.
+        """
+        key = (user_id, session_id)
+        with self._lock:
+            if key in self._pending:
+                payload = self._pending[key]
+            elif key in self._inflight:
+                payload = self._inflight[key]
+            else:
+                return False, None
+        return True, (None if payload is _DELETED else payload)
+
+    def clear_users(self, user_ids: Iterable[str]) -> None:
+        """Удалить все сессии пользователей, включая ещё не записанные."""
+        user_ids = set(user_ids)
+        with self._flush_lock:
+            with self._lock:
+                for key in [k for k in self._pending if k[0] in user_ids]:
+                    del self._pending[key]
+            with self._pool.connection() as client:
+                for chunk in chunks(user_ids, MAX_IN_PARAMS):
+                    client.execute(
+                        f'DELETE FROM {self._table} WHERE user_id IN ({placeholders(len(chunk))})',
+                        chunk
+                    )
+                client.commit()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch:
+                return
+
+            upserts = []
+            deletes = []
+            for (user_id, session_id), payload in batch.items():
+                if payload is _DELETED:
+                    deletes.append((user_id, session_id))
+                else:
+                    upserts.append((user_id, session_id, payload))
+
+            try:
+                with self._pool.connection() as client:
+                    if upserts:
+                        client.executemany(self._upsert_sql, upserts)
+                    if deletes:
+                        client.executemany(
+                            f'DELETE FROM {self._table} WHERE user_id=? AND session_id=?',
+                            deletes
+                        )
+                    client.commit()
+            except Exception:
+                with self._lock:
+                    for key, payload in batch.items():
+                        self._pending.setdefault(key, payload)
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush session writes')
+
+
+class SessionSweeper:
+    """Фоновая очистка просроченных сессий.
+
+    Раз в ``interval`` секунд удаляет строки, не обновлявшиеся дольше
+    ``ttl`` секунд, порциями по ``batch_size`` (каждая порция — отдельная
+    короткая транзакция, индекс по ``updated_at`` делает поиск дешёвым),
+    затем возвращает свободные страницы через ``incremental_vacuum`` и
+    выполняет ``wal_checkpoint``. Метрики доступны через ``stats()``.
+    """
+
+    def __init__(
+            self,
+            pool: SQLiteConnectionPool,
+            table: str,
+            ttl: float,
+            interval: float = 300,
+            batch_size: int = 500,
+            vacuum_pages: int = 1000,
+            checkpoint_mode: str = 'PASSIVE'
+    ):
+        self._pool = pool
+        self._table = table
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.checkpoint_mode = checkpoint_mode
+
+        self.runs = 0
+        self.rows_purged = 0
+        self.last_run_purged = 0
+        self.last_run_at: Optional[float] = None
+        self.last_run_duration: Optional[float] = None
+        self.db_size_bytes: Optional[int] = None
+        self.free_bytes: Optional[int] = None
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def purge_expired(self) -> int:
+        purged = 0
+        while True:
+            with self._pool.connection() as client:
+                cur = client.execute(
+                    f'''DELETE FROM {self._table} WHERE rowid IN (
+                        SELECT rowid FROM {self._table}
+                        WHERE updated_at < datetime('now', ?)
+                        LIMIT ?
+                    )''',
+                    (f'-{int(self.ttl)} seconds', self.batch_size)
+                )
+                client.commit()
+            purged += cur.rowcount
+            if cur.rowcount < self.batch_size or self._stop.is_set():
+                return purged
+
+    def run_once(self) -> int:
+        started = time.monotonic()
+        purged = self.purge_expired()
+
+        with self._pool.connection() as client:
+            client.execute(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)});').fetchall()
+            client.execute(f'PRAGMA wal_checkpoint({self.checkpoint_mode});').fetchall()
+            page_size = client.execute('PRAGMA page_size;').fetchone()[0]
+            page_count = client.execute('PRAGMA page_count;').fetchone()[0]
+            freelist_count = client.execute('PRAGMA freelist_count;').fetchone()[0]
+
+        self.runs += 1
+        self.rows_purged += purged
+        self.last_run_purged = purged
+        self.last_run_at = time.time()
+        self.last_run_duration = time.monotonic() - started
+        self.db_size_bytes = page_size * page_count
+        self.free_bytes = page_size * freelist_count
+        return purged
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='session-sweeper',
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            'runs': self.runs,
+            'rows_purged': self.rows_purged,
+            'last_run_purged': self.last_run_purged,
+            'last_run_at': self.last_run_at,
+            'last_run_duration': self.last_run_duration,
+            'db_size_bytes': self.db_size_bytes,
+            'free_bytes': self.free_bytes,
+        }
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Failed to purge expired sessions')
+            self._stop.wait(self.interval)
+
+
 class BaseSession:
     def __init__(self, user_id: str, session_id: str):
         self.user_id = user_id
@@ -31,8 +469,179 @@ class BaseSession:
     def clear_all_sessions(self) -> None:
         raise NotImplementedError
 
+    def iter_all(self, batch_size: int = 500) -> Iterator[dict]:
+        """Лениво перебрать данные всех сессий пользователя."""
+        raise NotImplementedError
+
+    @classmethod
+    def get_many(cls, user_ids: Iterable[str]) -> dict[str, list[dict]]:
+        """Данные всех сессий нескольких пользователей: ``{user_id: [data, ...]}``."""
+        raise NotImplementedError
+
+    @classmethod
+    def clear_many(cls, user_ids: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    def get_key(self, key: str, default=None):
+        return self.get().get(key, default)
+
+    def update(self, **values) -> None:
+        """Обновить отдельные ключи сессии, не трогая остальные."""
+        self.set({**self.get(), **values})
+
+    def pop(self, key: str, default=None):
+        data = self.get()
+        if key not in data:
+            return default
+        value = data.pop(key)
+        self.set(data)
+        return value
+
+
+class AsyncBaseSession(BaseSession):
+    """Сессия с асинхронным хранилищем: все методы — корутины.
+
+    Декораторы ``stateful_dialog``/``stateful_attachment`` вызывают
+    ``await session.open()`` перед передачей сессии в обработчик.
+    """
+
+    async def open(self) -> None:
+        pass
+
+    async def get(self) -> dict:
+        raise NotImplementedError
+
+    async def get_all(self) -> list[dict]:
+        raise NotImplementedError
+
+    async def set(self, data: dict) -> None:
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+    async def clear_all_sessions(self) -> None:
+        raise NotImplementedError
+
+    def iter_all(self, batch_size: int = 500) -> AsyncIterator[dict]:
+        raise NotImplementedError
+
+    @classmethod
+    async def get_many(cls, user_ids: Iterable[str]) -> dict[str, list[dict]]:
+        raise NotImplementedError
 
-class SQLiteSession(BaseSession):
+    @classmethod
+    async def clear_many(cls, user_ids: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    async def get_key(self, key: str, default=None):
+        return (await self.get()).get(key, default)
+
+    async def update(self, **values) -> None:
+        await self.set({**(await self.get()), **values})
+
+    async def pop(self, key: str, default=None):
+        data = await self.get()
+        if key not in data:
+            return default
+        value = data.pop(key)
+        await self.set(data)
+        return value
+
+
+class _SQLiteSessionQueries:
+    """Общие SQL-запросы ``SQLiteSession`` и ``AsyncSQLiteSession``.
+
+    Наследники задают ``_TABLE`` и ``_CODEC``.
+    """
+
+    _TABLE: str
+    _CODEC: SessionCodec
+
+    _CREATE_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS {table} (
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        data TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY(user_id, session_id)
+    )'''
+    _CREATE_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS {table}_updated_at_idx ON {table} (updated_at)'
+    _UPSERT_SQL = '''INSERT INTO {table} (user_id, session_id, data, updated_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id, session_id) DO UPDATE SET
+            data=excluded.data,
+            updated_at=CURRENT_TIMESTAMP'''
+    _PATCH_SQL = '''INSERT INTO {table} (user_id, session_id, data, updated_at)
+        VALUES (?, ?, json_set('{{}}', {pairs}), CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id, session_id) DO UPDATE SET
+            data=json_set(data, {pairs}),
+            updated_at=CURRENT_TIMESTAMP
+        WHERE typeof(data) = 'text\''''
+    _REMOVE_KEY_SQL = '''UPDATE {table} SET
+            data=json_remove(data, ?),
+            updated_at=CURRENT_TIMESTAMP
+        WHERE user_id=? AND session_id=?'''
+    _GET_KEY_SQL = '''SELECT
+            typeof(data),
+            CASE WHEN typeof(data) = 'text' THEN json_type(data, ?) END,
+            CASE WHEN typeof(data) = 'text' THEN json_extract(data, ?) ELSE data END
+        FROM {table} WHERE user_id=? AND session_id=?'''
+    _GET_FULL_SQL = '''SELECT 'full', NULL, data
+        FROM {table} WHERE user_id=? AND session_id=?'''
+    _ITER_SQL = '''SELECT session_id, data FROM {table}
+        WHERE user_id=? AND session_id > ?
+        ORDER BY session_id
+        LIMIT ?'''
+
+    # auto_vacuum применяется только к новой базе, существующую нужно
+    # один раз перевести через VACUUM.
+    _PRAGMAS = ('auto_vacuum=INCREMENTAL',)
+
+    @classmethod
+    def _patch_query(cls, values: dict) -> Optional[tuple[str, list]]:
+        """SQL и параметры для ``update`` через ``json_set`` или None, если нельзя."""
+        if not isinstance(cls._CODEC, JSONCodec):
+            return None
+
+        pairs = []
+        for key, value in values.items():
+            path = _json_path(key)
+            if path is None:
+                return None
+            pairs += [path, json.dumps(value, ensure_ascii=False)]
+
+        sql = cls._PATCH_SQL.format(
+            table=cls._TABLE,
+            pairs=', '.join(['?, json(?)'] * len(values))
+        )
+        return sql, pairs
+
+    @classmethod
+    def _get_key_query(cls, key: str) -> tuple[str, list]:
+        path = _json_path(key)
+        if path is None:
+            return cls._GET_FULL_SQL.format(table=cls._TABLE), []
+        return cls._GET_KEY_SQL.format(table=cls._TABLE), [path, path]
+
+    def _read_key_row(self, row, key: str) -> tuple[bool, object, Optional[dict]]:
+        """Разобрать строку ``_get_key_query``: (найден ли ключ, значение, весь dict).
+
+        Весь dict возвращается только если строку пришлось декодировать целиком.
+        """
+        if row is None or row[0] == 'null':
+            return False, None, None
+
+        kind, json_type, value = row
+        if kind == 'text':
+            if json_type is None:
+                return False, None, None
+            return True, _json1_value(json_type, value), None
+
+        data = self._CODEC.decode(value) if value is not None else {}
+        return key in data, data.get(key), data
+
+
+class SQLiteSession(_SQLiteSessionQueries, BaseSession):
     """Хранение состояния диалога в локальной SQLite базе.
 
     Таблица schema:
@@ -43,6 +652,18 @@ class SQLiteSession(BaseSession):
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             PRIMARY KEY(user_id, session_id)
         )
+        CREATE INDEX IF NOT EXISTS sessions_updated_at_idx ON sessions (updated_at)
+
+    Соединения берутся из общего на процесс ``SQLiteConnectionPool``
+    (по одному пулу на ``_DB_PATH``), размер пула задаётся через
+    ``configure_pool``. ``enable_write_behind`` включает отложенную
+    групповую запись изменений через ``SessionWriteBuffer``,
+    ``start_sweeper`` — удаление сессий старше заданного TTL.
+    Формат колонки ``data`` задаётся кодеком (``configure_codec``),
+    по умолчанию JSON: тогда ``update``/``pop``/``get_key`` работают через
+    JSON1 (``json_set``/``json_remove``/``json_extract``) и передают только
+    затронутые ключи. Для остальных форматов ``update``/``pop`` читают и
+    переписывают строку внутри ``BEGIN IMMEDIATE``.
     """
 
     _DB_PATH = '.sessions.db'
@@ -50,86 +671,779 @@ class SQLiteSession(BaseSession):
     _INIT_LOCK = threading.Lock()
     _INITIALIZED = False
 
+    _POOL_SIZE = 4
+    _CACHED_STATEMENTS = 256
+    _POOLS: dict[str, SQLiteConnectionPool] = {}
+    _POOLS_LOCK = threading.Lock()
+    _CODEC: SessionCodec = JSONCodec()
+    _WRITE_BUFFER: Optional[SessionWriteBuffer] = None
+    _SWEEPER: Optional[SessionSweeper] = None
+
     def __init__(self, user_id: str, session_id: Optional[str]):
         super().__init__(user_id, session_id)
-        
-        self._client = sqlite3.connect(self._DB_PATH, check_same_thread=False)
-        self._client.execute('PRAGMA journal_mode=WAL;')
-        self._client.execute('PRAGMA foreign_keys=ON;')
-        self._init_db()
-
-    def _init_db(self) -> None:
-        if self.__class__._INITIALIZED:
+
+        self._pool = self._get_pool()
+
+    @classmethod
+    def enable_write_behind(cls, flush_interval: float = 0.05, max_batch: int = 100) -> SessionWriteBuffer:
+        """Включить отложенную запись: ``set``/``clear`` попадают в общую
+        транзакцию, которая фиксируется раз в ``flush_interval`` секунд
+        или по накоплении ``max_batch`` изменений.
+        """
+        cls.disable_write_behind()
+        cls._WRITE_BUFFER = SessionWriteBuffer(
+            cls._get_pool(),
+            cls._TABLE,
+            cls._UPSERT_SQL.format(table=cls._TABLE),
+            flush_interval=flush_interval,
+            max_batch=max_batch
+        )
+        return cls._WRITE_BUFFER
+
+    @classmethod
+    def disable_write_behind(cls) -> None:
+        """Сбросить очередь отложенной записи в базу и выключить её."""
+        buffer = cls._WRITE_BUFFER
+        if buffer is not None:
+            cls._WRITE_BUFFER = None
+            buffer.close()
+
+    @classmethod
+    def start_sweeper(
+            cls,
+            ttl: float,
+            interval: float = 300,
+            batch_size: int = 500,
+            vacuum_pages: int = 1000
+    ) -> SessionSweeper:
+        """Запустить фоновое удаление сессий, не обновлявшихся ``ttl`` секунд."""
+        cls.stop_sweeper()
+        cls._SWEEPER = SessionSweeper(
+            cls._get_pool(),
+            cls._TABLE,
+            ttl,
+            interval=interval,
+            batch_size=batch_size,
+            vacuum_pages=vacuum_pages
+        )
+        cls._SWEEPER.start()
+        return cls._SWEEPER
+
+    @classmethod
+    def stop_sweeper(cls) -> None:
+        sweeper = cls._SWEEPER
+        if sweeper is not None:
+            cls._SWEEPER = None
+            sweeper.stop()
+
+    @classmethod
+    def configure_codec(cls, codec: SessionCodec) -> None:
+        """Задать формат записи данных; строки в старом формате читаются как раньше."""
+        cls._CODEC = codec
+
+    @classmethod
+    def configure_pool(cls, pool_size: int = None, cached_statements: int = None) -> None:
+        """Задать параметры пула. Уже открытый пул для ``_DB_PATH`` закрывается."""
+        if pool_size is not None:
+            cls._POOL_SIZE = pool_size
+        if cached_statements is not None:
+            cls._CACHED_STATEMENTS = cached_statements
+
+        with cls._POOLS_LOCK:
+            pool = cls._POOLS.pop(cls._DB_PATH, None)
+        if pool:
+            pool.close()
+
+    @classmethod
+    def _get_pool(cls) -> SQLiteConnectionPool:
+        pool = cls._POOLS.get(cls._DB_PATH)
+        if pool is not None:
+            return pool
+
+        with cls._POOLS_LOCK:
+            pool = cls._POOLS.get(cls._DB_PATH)
+            if pool is None:
+                pool = SQLiteConnectionPool(
+                    cls._DB_PATH,
+                    pool_size=cls._POOL_SIZE,
+                    cached_statements=cls._CACHED_STATEMENTS,
+                    pragmas=cls._PRAGMAS,
+                    on_connect=cls._init_db
+                )
+                cls._POOLS[cls._DB_PATH] = pool
+            return pool
+
+    @classmethod
+    def _init_db(cls, client: sqlite3.Connection) -> None:
+        if cls._INITIALIZED:
             return
-        with self.__class__._INIT_LOCK:
-            if self.__class__._INITIALIZED:
+        with cls._INIT_LOCK:
+            if cls._INITIALIZED:
                 return
-            self._client.execute(
-                f'''CREATE TABLE IF NOT EXISTS {self._TABLE} (
-                    user_id TEXT NOT NULL,
-                    session_id TEXT NOT NULL,
-                    data TEXT,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY(user_id, session_id)
-                )'''
-            )
-            self._client.commit()
-            self.__class__._INITIALIZED = True
+            client.execute(cls._CREATE_TABLE_SQL.format(table=cls._TABLE))
+            client.execute(cls._CREATE_INDEX_SQL.format(table=cls._TABLE))
+            client.commit()
+            cls._INITIALIZED = True
 
     def get(self) -> dict:
-        cur = self._client.cursor()
-        cur.execute(
-            f'SELECT data FROM {self._TABLE} WHERE user_id=? AND session_id=?',
-            (self.user_id, self.session_id)
-        )
-        row = cur.fetchone()
+        if self._WRITE_BUFFER is not None:
+            pending, payload = self._WRITE_BUFFER.lookup(self.user_id, self.session_id)
+            if pending:
+                return self._CODEC.decode(payload) if payload is not None else {}
+
+        with self._pool.connection() as client:
+            row = client.execute(
+                f'SELECT data FROM {self._TABLE} WHERE user_id=? AND session_id=?',
+                (self.user_id, self.session_id)
+            ).fetchone()
         if not row or row[0] is None:
             return {}
         try:
-            return json.loads(row[0])
+            return self._CODEC.decode(row[0])
         except Exception:
             self.clear()
             return {}
 
     def get_all(self) -> list[dict]:
-        cur = self._client.cursor()
-        cur.execute(
-            f'SELECT data FROM {self._TABLE} WHERE user_id=?',
-            (self.user_id,)
-        )
-        return cur.fetchall()
+        if self._WRITE_BUFFER is not None:
+            self._WRITE_BUFFER.flush()
+
+        with self._pool.connection() as client:
+            return client.execute(
+                f'SELECT data FROM {self._TABLE} WHERE user_id=?',
+                (self.user_id,)
+            ).fetchall()
 
     def set(self, data: dict) -> None:
         if not isinstance(data, dict):
             raise TypeError('Session data must be dict')
 
-        json_payload = json.dumps(data, ensure_ascii=False)
-        self._client.execute(
-            f'''INSERT INTO {self._TABLE} (user_id, session_id, data, updated_at)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(user_id, session_id) DO UPDATE SET
-                    data=excluded.data,
-                    updated_at=CURRENT_TIMESTAMP''',
-            (self.user_id, self.session_id, json_payload)
-        )
-        self._client.commit()
+        payload = self._CODEC.encode(data)
+        if self._WRITE_BUFFER is not None:
+            self._WRITE_BUFFER.put(self.user_id, self.session_id, payload)
+            return
+
+        with self._pool.connection() as client:
+            client.execute(
+                self._UPSERT_SQL.format(table=self._TABLE),
+                (self.user_id, self.session_id, payload)
+            )
+            client.commit()
 
     def clear(self) -> None:
-        self._client.execute(
-            f'DELETE FROM {self._TABLE} WHERE user_id=? AND session_id=?',
-            (self.user_id, self.session_id)
-        )
-        self._client.commit()
+        if self._WRITE_BUFFER is not None:
+            self._WRITE_BUFFER.delete(self.user_id, self.session_id)
+            return
+
+        with self._pool.connection() as client:
+            client.execute(
+                f'DELETE FROM {self._TABLE} WHERE user_id=? AND session_id=?',
+                (self.user_id, self.session_id)
+            )
+            client.commit()
 
     def clear_all_sessions(self) -> None:
-        self._client.execute(
-            f'DELETE FROM {self._TABLE} WHERE user_id=?',
+        if self._WRITE_BUFFER is not None:
+            self._WRITE_BUFFER.clear_users([self.user_id])
+            return
+
+        with self._pool.connection() as client:
+            client.execute(
+                f'DELETE FROM {self._TABLE} WHERE user_id=?',
+                (self.user_id,)
+            )
+            client.commit()
+
+    def iter_all(self, batch_size: int = 500) -> Iterator[dict]:
+        """Перебирает сессии порциями по ``batch_size`` с keyset-пагинацией
+        по первичному ключу, соединение между порциями возвращается в пул.
+        """
+        if self._WRITE_BUFFER is not None:
+            self._WRITE_BUFFER.flush()
+
+        last_session_id = ''
+        while True:
+            with self._pool.connection() as client:
+                rows = client.execute(
+                    self._ITER_SQL.format(table=self._TABLE),
+                    (self.user_id, last_session_id, batch_size)
+                ).fetchall()
+
+            for _, data in rows:
+                yield self._CODEC.decode(data) if data is not None else {}
+
+            if len(rows) < batch_size:
+                return
+            last_session_id = rows[-1][0]
+
+    @classmethod
+    def get_many(cls, user_ids: Iterable[str]) -> dict[str, list[dict]]:
+        if cls._WRITE_BUFFER is not None:
+            cls._WRITE_BUFFER.flush()
+
+        result = {}
+        pool = cls._get_pool()
+        for chunk in chunks(dict.fromkeys(user_ids), MAX_IN_PARAMS):
+            with pool.connection() as client:
+                rows = client.execute(
+                    f'SELECT user_id, data FROM {cls._TABLE} WHERE user_id IN ({placeholders(len(chunk))})',
+                    chunk
+                ).fetchall()
+            for user_id, data in rows:
+                result.setdefault(user_id, []).append(
+                    cls._CODEC.decode(data) if data is not None else {}
+                )
+        return result
+
+    @classmethod
+    def clear_many(cls, user_ids: Iterable[str]) -> None:
+        if cls._WRITE_BUFFER is not None:
+            cls._WRITE_BUFFER.clear_users(user_ids)
+            return
+
+        with cls._get_pool().connection() as client:
+            for chunk in chunks(dict.fromkeys(user_ids), MAX_IN_PARAMS):
+                client.execute(
+                    f'DELETE FROM {cls._TABLE} WHERE user_id IN ({placeholders(len(chunk))})',
+                    chunk
+                )
+            client.commit()
+
+    def get_key(self, key: str, default=None):
+        if self._WRITE_BUFFER is not None:
+            pending, payload = self._WRITE_BUFFER.lookup(self.user_id, self.session_id)
+            if pending:
+                data = self._CODEC.decode(payload) if payload is not None else {}
+                return data.get(key, default)
+
+        sql, params = self._get_key_query(key)
+        with self._pool.connection() as client:
+            row = client.execute(sql, (*params, self.user_id, self.session_id)).fetchone()
+        found, value, _ = self._read_key_row(row, key)
+        return value if found else default
+
+    def update(self, **values) -> None:
+        if not values:
+            return
+        if self._WRITE_BUFFER is not None:
+            self._WRITE_BUFFER.flush()
+
+        patch = self._patch_query(values)
+        with self._pool.connection() as client:
+            client.execute('BEGIN IMMEDIATE')
+            if patch is not None:
+                sql, pairs = patch
+                cur = client.execute(sql, (self.user_id, self.session_id, *pairs, *pairs))
+                if cur.rowcount:
+                    client.commit()
+                    return
+
+            row = client.execute(
+                f'SELECT data FROM {self._TABLE} WHERE user_id=? AND session_id=?',
+                (self.user_id, self.session_id)
+            ).fetchone()
+            data = self._CODEC.decode(row[0]) if row and row[0] is not None else {}
+            data.update(values)
+            client.execute(
+                self._UPSERT_SQL.format(table=self._TABLE),
+                (self.user_id, self.session_id, self._CODEC.encode(data))
+            )
+            client.commit()
+
+    def pop(self, key: str, default=None):
+        if self._WRITE_BUFFER is not None:
+            self._WRITE_BUFFER.flush()
+
+        sql, params = self._get_key_query(key)
+        with self._pool.connection() as client:
+            client.execute('BEGIN IMMEDIATE')
+            row = client.execute(sql, (*params, self.user_id, self.session_id)).fetchone()
+            found, value, data = self._read_key_row(row, key)
+            if not found:
+                client.rollback()
+                return default
+
+            if data is None:
+                client.execute(
+                    self._REMOVE_KEY_SQL.format(table=self._TABLE),
+                    (_json_path(key), self.user_id, self.session_id)
+                )
+            else:
+                data.pop(key)
+                client.execute(
+                    self._UPSERT_SQL.format(table=self._TABLE),
+                    (self.user_id, self.session_id, self._CODEC.encode(data))
+                )
+            client.commit()
+        return value
+
+
+class AsyncSQLiteSession(_SQLiteSessionQueries, AsyncBaseSession):
+    """Асинхронный вариант ``SQLiteSession`` поверх aiosqlite.
+
+    Использует ту же таблицу и файл базы, что и ``SQLiteSession``.
+    Все сессии одного event loop делят одно соединение aiosqlite,
+    запросы которого выполняются в фоновом потоке и не блокируют loop.
+    Записи в общее соединение сериализуются ``asyncio.Lock``, чтобы
+    транзакция ``update``/``pop`` не смешивалась с чужими коммитами.
+
+    Соединение закрывается само, когда loop при завершении отменяет
+    оставшиеся задачи (как делает ``asyncio.run``); иначе его нужно закрыть
+    явно через ``close_connection()`` — поток aiosqlite не daemon и не даст
+    процессу завершиться.
+    """
+
+    _DB_PATH = SQLiteSession._DB_PATH
+    _TABLE = SQLiteSession._TABLE
+    _CODEC: SessionCodec = JSONCodec()
+    _CONNECTIONS = weakref.WeakKeyDictionary()
+    _CLOSERS = weakref.WeakKeyDictionary()
+    _LOCKS = weakref.WeakKeyDictionary()
+
+    def __init__(self, user_id: str, session_id: Optional[str]):
+        super().__init__(user_id, session_id)
+
+        self._client: Optional[aiosqlite.Connection] = None
+
+    async def open(self) -> None:
+        if self._client is None:
+            self._client = await self._get_connection()
+
+    @classmethod
+    def configure_codec(cls, codec: SessionCodec) -> None:
+        cls._CODEC = codec
+
+    @classmethod
+    async def _get_connection(cls) -> aiosqlite.Connection:
+        loop = asyncio.get_running_loop()
+        task = cls._CONNECTIONS.get(loop)
+        if task is None:
+            task = loop.create_task(cls._connect())
+            cls._CONNECTIONS[loop] = task
+
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            if cls._CONNECTIONS.get(loop) is task:
+                del cls._CONNECTIONS[loop]
+            raise
+
+    @classmethod
+    def _write_lock(cls) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        lock = cls._LOCKS.get(loop)
+        if lock is None:
+            lock = cls._LOCKS[loop] = asyncio.Lock()
+        return lock
+
+    @classmethod
+    async def _connect(cls) -> aiosqlite.Connection:
+        client = await aiosqlite.connect(cls._DB_PATH)
+        try:
+            for pragma in cls._PRAGMAS:
+                await client.execute(f'PRAGMA {pragma};')
+            await client.execute('PRAGMA journal_mode=WAL;')
+            await client.execute('PRAGMA foreign_keys=ON;')
+            await client.execute(cls._CREATE_TABLE_SQL.format(table=cls._TABLE))
+            await client.execute(cls._CREATE_INDEX_SQL.format(table=cls._TABLE))
+            await client.commit()
+        except Exception:
+            await client.close()
+            raise
+
+        loop = asyncio.get_running_loop()
+        cls._CLOSERS[loop] = loop.create_task(cls._close_on_shutdown(client))
+        return client
+
+    @classmethod
+    async def _close_on_shutdown(cls, client: aiosqlite.Connection) -> None:
+        """Ждёт отмены (``close_connection`` или завершение loop) и закрывает соединение."""
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            await client.close()
+
+    @classmethod
+    async def close_connection(cls) -> None:
+        """Закрыть общее соединение текущего event loop."""
+        loop = asyncio.get_running_loop()
+        task = cls._CONNECTIONS.pop(loop, None)
+        if task is None:
+            return
+
+        await asyncio.gather(task, return_exceptions=True)
+        closer = cls._CLOSERS.pop(loop, None)
+        if closer is not None:
+            closer.cancel()
+            await asyncio.gather(closer, return_exceptions=True)
+
+    async def get(self) -> dict:
+        await self.open()
+        async with self._client.execute(
+            f'SELECT data FROM {self._TABLE} WHERE user_id=? AND session_id=?',
+            (self.user_id, self.session_id)
+        ) as cur:
+            row = await cur.fetchone()
+        if not row or row[0] is None:
+            return {}
+        try:
+            return self._CODEC.decode(row[0])
+        except Exception:
+            await self.clear()
+            return {}
+
+    async def get_all(self) -> list[dict]:
+        await self.open()
+        async with self._client.execute(
+            f'SELECT data FROM {self._TABLE} WHERE user_id=?',
             (self.user_id,)
-        )
-        self._client.commit()
+        ) as cur:
+            return await cur.fetchall()
+
+    async def set(self, data: dict) -> None:
+        if not isinstance(data, dict):
+            raise TypeError('Session data must be dict')
+
+        await self.open()
+        payload = self._CODEC.encode(data)
+        async with self._write_lock():
+            await self._client.execute(
+                self._UPSERT_SQL.format(table=self._TABLE),
+                (self.user_id, self.session_id, payload)
+            )
+            await self._client.commit()
+
+    async def clear(self) -> None:
+        await self.open()
+        async with self._write_lock():
+            await self._client.execute(
+                f'DELETE FROM {self._TABLE} WHERE user_id=? AND session_id=?',
+                (self.user_id, self.session_id)
+            )
+            await self._client.commit()
+
+    async def clear_all_sessions(self) -> None:
+        await self.open()
+        async with self._write_lock():
+            await self._client.execute(
+                f'DELETE FROM {self._TABLE} WHERE user_id=?',
+                (self.user_id,)
+            )
+            await self._client.commit()
+
+    async def iter_all(self, batch_size: int = 500) -> AsyncIterator[dict]:
+        await self.open()
+        last_session_id = ''
+        while True:
+            async with self._client.execute(
+                self._ITER_SQL.format(table=self._TABLE),
+                (self.user_id, last_session_id, batch_size)
+            ) as cur:
+                rows = await cur.fetchall()
+
+            for _, data in rows:
+                yield self._CODEC.decode(data) if data is not None else {}
+
+            if len(rows) < batch_size:
+                return
+            last_session_id = rows[-1][0]
+
+    @classmethod
+    async def get_many(cls, user_ids: Iterable[str]) -> dict[str, list[dict]]:
+        client = await cls._get_connection()
+        result = {}
+        for chunk in chunks(dict.fromkeys(user_ids), MAX_IN_PARAMS):
+            async with client.execute(
+                f'SELECT user_id, data FROM {cls._TABLE} WHERE user_id IN ({placeholders(len(chunk))})',
+                chunk
+            ) as cur:
+                rows = await cur.fetchall()
+            for user_id, data in rows:
+                result.setdefault(user_id, []).append(
+                    cls._CODEC.decode(data) if data is not None else {}
+                )
+        return result
+
+    @classmethod
+    async def clear_many(cls, user_ids: Iterable[str]) -> None:
+        client = await cls._get_connection()
+        async with cls._write_lock():
+            for chunk in chunks(dict.fromkeys(user_ids), MAX_IN_PARAMS):
+                await client.execute(
+                    f'DELETE FROM {cls._TABLE} WHERE user_id IN ({placeholders(len(chunk))})',
+                    chunk
+                )
+            await client.commit()
+
+    async def get_key(self, key: str, default=None):
+        await self.open()
+        sql, params = self._get_key_query(key)
+        async with self._client.execute(sql, (*params, self.user_id, self.session_id)) as cur:
+            row = await cur.fetchone()
+        found, value, _ = self._read_key_row(row, key)
+        return value if found else default
+
+    async def update(self, **values) -> None:
+        if not values:
+            return
+
+        await self.open()
+        patch = self._patch_query(values)
+        async with self._write_lock():
+            try:
+                await self._client.execute('BEGIN IMMEDIATE')
+                if patch is not None:
+                    sql, pairs = patch
+                    cur = await self._client.execute(sql, (self.user_id, self.session_id, *pairs, *pairs))
+                    if cur.rowcount:
+                        await self._client.commit()
+                        return
+
+                async with self._client.execute(
+                    f'SELECT data FROM {self._TABLE} WHERE user_id=? AND session_id=?',
+                    (self.user_id, self.session_id)
+                ) as cur:
+                    row = await cur.fetchone()
+                data = self._CODEC.decode(row[0]) if row and row[0] is not None else {}
+                data.update(values)
+                await self._client.execute(
+                    self._UPSERT_SQL.format(table=self._TABLE),
+                    (self.user_id, self.session_id, self._CODEC.encode(data))
+                )
+                await self._client.commit()
+            except Exception:
+                await self._client.rollback()
+                raise
+
+    async def pop(self, key: str, default=None):
+        await self.open()
+        sql, params = self._get_key_query(key)
+        async with self._write_lock():
+            try:
+                await self._client.execute('BEGIN IMMEDIATE')
+                async with self._client.execute(sql, (*params, self.user_id, self.session_id)) as cur:
+                    row = await cur.fetchone()
+                found, value, data = self._read_key_row(row, key)
+                if not found:
+                    await self._client.rollback()
+                    return default
+
+                if data is None:
+                    await self._client.execute(
+                        self._REMOVE_KEY_SQL.format(table=self._TABLE),
+                        (_json_path(key), self.user_id, self.session_id)
+                    )
+                else:
+                    data.pop(key)
+                    await self._client.execute(
+                        self._UPSERT_SQL.format(table=self._TABLE),
+                        (self.user_id, self.session_id, self._CODEC.encode(data))
+                    )
+                await self._client.commit()
+            except Exception:
+                await self._client.rollback()
+                raise
+        return value
+
+
+class _SessionCacheGuard:
+    """Кэш сессий, который не даёт промаху ``get`` записать устаревшие данные.
+
+    Пока идёт чтение из хранилища, для ключа хранится поколение; каждая запись
+    его увеличивает, и прочитанное до записи в кэш уже не попадает.
+    """
+
+    def __init__(self, cache: LRUTTLCache):
+        self.cache = cache
+        # key -> [число идущих чтений, поколение]
+        self._reads: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def begin_read(self, key: tuple) -> tuple[list, int]:
+        with self._lock:
+            state = self._reads.setdefault(key, [0, 0])
+            state[0] += 1
+            return state, state[1]
+
+    def end_read(self, key: tuple, token: tuple[list, int], data: Optional[dict]) -> None:
+        state, generation = token
+        with self._lock:
+            state[0] -= 1
+            if state[0] == 0 and self._reads.get(key) is state:
+                del self._reads[key]
+            if data is not None and state[1] == generation:
+                self.cache.set(key, data)
+
+    def store(self, key: tuple, data: dict) -> None:
+        with self._lock:
+            self._bump(key)
+            self.cache.set(key, data)
+
+    def invalidate(self, key: tuple) -> None:
+        with self._lock:
+            self._bump(key)
+            self.cache.pop(key)
+
+    def invalidate_where(self, predicate) -> None:
+        with self._lock:
+            for key in self._reads:
+                if predicate(key):
+                    self._bump(key)
+            self.cache.pop_where(predicate)
+
+    def _bump(self, key: tuple) -> None:
+        state = self._reads.get(key)
+        if state is not None:
+            state[1] += 1
+
 
-    def __del__(self):
-        self._client.close()
+class _CachedSessionMixin:
+    _cache: _SessionCacheGuard
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        return cls._cache.cache.stats()
+
+    def get(self) -> dict:
+        key = (self.user_id, self.session_id)
+        data = self._cache.cache.get(key)
+        if data is None:
+            token = self._cache.begin_read(key)
+            try:
+                data = super().get()
+            finally:
+                self._cache.end_read(key, token, data)
+        return copy.deepcopy(data)
+
+    def set(self, data: dict) -> None:
+        super().set(data)
+        self._cache.store((self.user_id, self.session_id), copy.deepcopy(data))
+
+    def clear(self) -> None:
+        super().clear()
+        self._cache.invalidate((self.user_id, self.session_id))
+
+    def clear_all_sessions(self) -> None:
+        super().clear_all_sessions()
+        self._cache.invalidate_where(lambda key: key[0] == self.user_id)
+
+    @classmethod
+    def clear_many(cls, user_ids: Iterable[str]) -> None:
+        user_ids = set(user_ids)
+        super().clear_many(user_ids)
+        cls._cache.invalidate_where(lambda key: key[0] in user_ids)
+
+    def get_key(self, key: str, default=None):
+        data = self._cache.cache.get((self.user_id, self.session_id))
+        if data is not None:
+            return copy.deepcopy(data.get(key, default))
+        return super().get_key(key, default)
+
+    def update(self, **values) -> None:
+        super().update(**values)
+        self._cache.invalidate((self.user_id, self.session_id))
+
+    def pop(self, key: str, default=None):
+        value = super().pop(key, default)
+        self._cache.invalidate((self.user_id, self.session_id))
+        return value
+
+
+class _AsyncCachedSessionMixin:
+    _cache: _SessionCacheGuard
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        return cls._cache.cache.stats()
+
+    async def get(self) -> dict:
+        key = (self.user_id, self.session_id)
+        data = self._cache.cache.get(key)
+        if data is None:
+            token = self._cache.begin_read(key)
+            try:
+                data = await super().get()
+            finally:
+                self._cache.end_read(key, token, data)
+        return copy.deepcopy(data)
+
+    async def set(self, data: dict) -> None:
+        await super().set(data)
+        self._cache.store((self.user_id, self.session_id), copy.deepcopy(data))
+
+    async def clear(self) -> None:
+        await super().clear()
+        self._cache.invalidate((self.user_id, self.session_id))
+
+    async def clear_all_sessions(self) -> None:
+        await super().clear_all_sessions()
+        self._cache.invalidate_where(lambda key: key[0] == self.user_id)
+
+    @classmethod
+    async def clear_many(cls, user_ids: Iterable[str]) -> None:
+        user_ids = set(user_ids)
+        await super().clear_many(user_ids)
+        cls._cache.invalidate_where(lambda key: key[0] in user_ids)
+
+    async def get_key(self, key: str, default=None):
+        data = self._cache.cache.get((self.user_id, self.session_id))
+        if data is not None:
+            return copy.deepcopy(data.get(key, default))
+        return await super().get_key(key, default)
+
+    async def update(self, **values) -> None:
+        await super().update(**values)
+        self._cache.invalidate((self.user_id, self.session_id))
+
+    async def pop(self, key: str, default=None):
+        value = await super().pop(key, default)
+        self._cache.invalidate((self.user_id, self.session_id))
+        return value
+
+
+def cached_session(
+        session_class: type[BaseSession],
+        max_size: int = 1024,
+        ttl: Optional[float] = 300
+) -> type[BaseSession]:
+    """
+    Обернуть класс сессии кэшем уже декодированных данных.
+
+    Возвращает наследника ``session_class``: ``get`` отдаёт глубокую копию dict из
+    общего для всех экземпляров LRU/TTL кэша, ``set`` пишет и в хранилище,
+    и в кэш, ``clear``/``clear_all_sessions`` инвалидируют записи. Промах,
+    во время которого ту же сессию записали, в кэш не попадает.
+    Статистика попаданий доступна через ``cache_stats()``.
+
+        CachedSession = cached_session(SQLiteSession, max_size=4096, ttl=600)
+
+        @stateful_attachment(CachedSession)
+        async def handler(self, event, session): ...
+
+    Кэш локален для процесса: изменения из других процессов видны
+    только после истечения ``ttl``.
+    """
+    if issubclass(session_class, AsyncBaseSession):
+        mixin = _AsyncCachedSessionMixin
+    else:
+        mixin = _CachedSessionMixin
+
+    return type(
+        f'Cached{session_class.__name__}',
+        (mixin, session_class),
+        {'_cache': _SessionCacheGuard(LRUTTLCache(max_size=max_size, ttl=ttl))}
+    )
+
+
+async def _open_session(
+        session_class: type[BaseSession],
+        user_id: str,
+        session_id: Optional[str]
+) -> BaseSession:
+    session = session_class(user_id, session_id)
+    if isinstance(session, AsyncBaseSession):
+        await session.open()
+    return session
 
 
 def stateful_dialog(session_class: type[BaseSession] = SQLiteSession):
@@ -137,12 +1451,14 @@ def stateful_dialog(session_class: type[BaseSession] = SQLiteSession):
     Декоратор: создаёт/обновляет сессию и передаёт её в целевую корутину.
     Ожидаемый сигнатурный вид целевой функции:
         async def handler(self, event, session: BaseSession)
+
+    Для наследников ``AsyncBaseSession`` методы сессии нужно await-ить.
     """
     def decorator(func):
         @wraps(func)
         async def wrapper(self, event):
             session_id = event.body.get("state")
-            session = session_class(event.user_id, session_id)
+            session = await _open_session(session_class, event.user_id, session_id)
             return await func(self, event, session)
         return wrapper
     return decorator
@@ -153,12 +1469,14 @@ def stateful_attachment(session_class: type[BaseSession] = SQLiteSession):
     Декоратор: создаёт/обновляет сессию и передаёт её в целевую корутину.
     Ожидаемый сигнатурный вид целевой функции:
         async def handler(self, event, session: BaseSession)
+
+    Для наследников ``AsyncBaseSession`` методы сессии нужно await-ить.
     """
     def decorator(func):
         @wraps(func)
         async def wrapper(self, event):
             session_id = event.body.get("context", {}).get("session_id")
-            session = session_class(event.user_id, session_id)
+            session = await _open_session(session_class, event.user_id, session_id)
             return await func(self, event, session)
         return wrapper
     return decorator
\ No newline at end of file
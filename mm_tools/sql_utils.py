@@ -0,0 +1,21 @@
+from typing import Iterable, Iterator
+
+# Not more parameters in one ``IN (...)`` than old SQLite builds allow.
+MAX_IN_PARAMS = 500
+
+
+def chunks(items: Iterable, size: int) -> Iterator[list]:
+    """Split ``items`` into lists of at most ``size`` items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def placeholders(count: int) -> str:
+    """``?, ?, ...`` with ``count`` qmark parameters, for ``IN (...)`` clauses."""
+    return ', '.join(['?'] * count)